@@ -0,0 +1,62 @@
+from collections import Counter
+
+try:
+    import pandas
+except ImportError:
+    pandas = None
+
+# one row per show: what the rollups are computed from
+COLUMNS = ('start_time', 'venue_id', 'artist_id', 'city', 'state', 'genres')
+PERIODS = ('day', 'month')
+DIMENSIONS = ('all', 'genre', 'city', 'state', 'venue', 'artist')
+
+
+def city_key(city, state):
+    return f'{city}, {state}'
+
+
+def rollup_keys(start_time, venue_id, artist_id, city, state, genres):
+    """The (period, bucket, dimension, key) cells a single show counts towards."""
+    day = start_time.date()
+    buckets = {'day': day, 'month': day.replace(day=1)}
+    keys = [('all', ''), ('city', city_key(city, state)), ('state', state),
+        ('venue', str(venue_id)), ('artist', str(artist_id))]
+    keys.extend(('genre', genre) for genre in sorted(set(genres or ())))
+    for period in PERIODS:
+        for dimension, key in keys:
+            yield period, buckets[period], dimension, key
+
+
+def count_rollups(rows):
+    """Count shows per rollup cell for a batch of rows shaped like COLUMNS.
+
+    With pandas the batch is grouped column-wise, which is what makes a full
+    backfill over millions of shows practical; without it every row is
+    expanded in Python and counted.
+    """
+    rows = list(rows)
+    if pandas is None or len(rows) < 1000:
+        return Counter(cell for row in rows for cell in rollup_keys(*row))
+    frame = pandas.DataFrame.from_records(rows, columns=COLUMNS)
+    frame['day'] = frame.start_time.dt.normalize()
+    frame['month'] = frame.start_time.dt.to_period('M').dt.to_timestamp()
+    keys = {
+        'all': pandas.Series('', index=frame.index),
+        'city': frame.city + ', ' + frame.state,
+        'state': frame.state,
+        'venue': frame.venue_id.astype(str),
+        'artist': frame.artist_id.astype(str),
+    }
+    # a show counts once per distinct genre of its venue
+    genres = frame[['day', 'month', 'genres']].explode('genres').dropna()
+    genres = genres.reset_index().drop_duplicates(['index', 'genres'])
+    counts = Counter()
+    for period in PERIODS:
+        for dimension, key in keys.items():
+            grouped = frame.groupby([frame[period], key]).size()
+            for (bucket, value), count in grouped.items():
+                counts[(period, bucket.date(), dimension, value)] += int(count)
+        grouped = genres.groupby([period, 'genres']).size()
+        for (bucket, value), count in grouped.items():
+            counts[(period, bucket.date(), 'genre', value)] += int(count)
+    return counts
@@ -2,18 +2,47 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import gzip
 import json
+import os
+import re
+import select
+import shutil
+import threading
+import time
+import traceback
+import click
+import itertools
+import math
+from functools import lru_cache, wraps
+from collections import Counter
 import dateutil.parser
 import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, stream_with_context, \
+    send_from_directory
 from flask_moment import Moment
+from jinja2 import FileSystemBytecodeCache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, insert as pg_insert
 import logging
 from logging import Formatter, FileHandler
 from flask_wtf import FlaskForm
 from forms import *
+from prefix_index import PrefixIndex
+import export
+import analytics
+from broker import Broker
+from catalog import Catalog
+import recurrence
+import dedup
+import ical
+import sitemap
+from ratelimit import Limiter
+from compression import CompressionMiddleware, CompressionStats, ROUTE_KEY
+from werkzeug.exceptions import TooManyRequests
 from flask_migrate import Migrate
-from datetime import datetime
+from datetime import date, datetime, timedelta
+from calendar import Calendar
 #----------------------------------------------------------------------------#
 # App Config.
 #----------------------------------------------------------------------------#
@@ -21,6 +50,24 @@ from datetime import datetime
 app = Flask(__name__)
 moment = Moment(app)
 app.config.from_object('config')
+# drop the line break after a block tag and the indentation before it, so
+# {% for %}/{% if %} lines don't leave blank lines in the HTML
+app.jinja_env.trim_blocks = True
+app.jinja_env.lstrip_blocks = True
+# compiled templates are kept on disk, so a new worker loads their bytecode
+# instead of compiling every template again on its first requests. The
+# whitespace options change the bytecode but not the cache key, hence the
+# pattern.
+os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(app.config['TEMPLATE_CACHE_DIR'],
+    pattern='__jinja2_%s.trim.cache')
+# minified and gzip/brotli compressed unless COMPRESSION is off (e.g. when
+# nginx in front compresses); /compression/stats shows what it saves and costs
+compression_stats = CompressionStats()
+if app.config['COMPRESSION']:
+    app.wsgi_app = CompressionMiddleware(app.wsgi_app, compression_stats,
+        min_size=app.config['COMPRESSION_MIN_SIZE'], gzip_level=app.config['COMPRESSION_GZIP_LEVEL'],
+        brotli_level=app.config['COMPRESSION_BROTLI_LEVEL'], minify=app.config['HTML_MINIFY'])
 db = SQLAlchemy(app)
 
 migrate = Migrate(app, db)
@@ -29,14 +76,38 @@ migrate = Migrate(app, db)
 #----------------------------------------------------------------------------#
 class Shows(db.Model):
     __tablename__ = 'shows'
-    id = db.Column(db.Integer, primary_key=True)
-    start_time = db.Column(db.DateTime())
-    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id'))
-    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id'))
+    # range partitioned by month of start_time, so it is part of the key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    start_time = db.Column(db.DateTime(), primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'))
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'))
+    series_id = db.Column(db.Integer, db.ForeignKey('show_series.id', ondelete='SET NULL'))
+
+    __table_args__ = (
+        db.Index('ix_shows_venue_id', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time', 'start_time'),
+        db.Index('ix_shows_series_id', 'series_id', 'start_time'),
+        {'postgresql_partition_by': 'RANGE (start_time)'},
+    )
 
     def __repr(self):
         return f'<Show ID: {self.id}, start time: {self.start_time}, Artist ID: {self.artist_id}, Venue ID: {self.venue_id}>'
 
+class ShowSeries(db.Model):
+    __tablename__ = 'show_series'
+    # a recurring show: rule is an RRULE line expanded from first_start_time,
+    # each occurrence is an ordinary row in shows pointing back here
+    id = db.Column(db.Integer, primary_key=True)
+    artist_id = db.Column(db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), nullable=False)
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), nullable=False)
+    first_start_time = db.Column(db.DateTime(), nullable=False)
+    rule = db.Column(db.String(), nullable=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    def __repr__(self):
+        return f'<ShowSeries {self.id}: {self.rule} from {self.first_start_time}>'
+
 class Venue(db.Model):
     __tablename__ = 'venues'
 
@@ -49,10 +120,25 @@ class Venue(db.Model):
     image_link = db.Column(db.String(500), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False, default="No Facebook page")
     website = db.Column(db.String(120), nullable=False, default="No Website")
-    genres = db.Column(db.ARRAY(db.String),nullable=False)
+    genres = db.Column(ARRAY(db.String),nullable=False)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(250), nullable=False, default="Not currently seeking talent")
-    show_info = db.relationship('Shows', cascade="all, delete-orphan", backref='venues', primaryjoin=id ==Shows.venue_id)
+    show_info = db.relationship('Shows', cascade="all, delete-orphan", passive_deletes=True, backref='venues', primaryjoin=id ==Shows.venue_id)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    # bumped whenever the venue's calendar feed changes, and its cache key
+    schedule_changed_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    # bumped by every edit; the sitemap's lastmod
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    # dedup.name_bands(name): the LSH buckets the name falls in
+    name_bands = db.Column(ARRAY(db.BigInteger))
+
+    __table_args__ = (
+        db.Index('ix_venues_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_venues_state_city', 'state', 'city'),
+        # duplicate detection compares venues within a state and city
+        db.Index('ix_venues_dedup_block', 'state', db.func.lower(city)),
+        db.Index('ix_venues_name_bands', 'name_bands', postgresql_using='gin'),
+    )
 
     def __repr(self):
         return f'<Venue ID: {self.id}, name: {self.name}>'
@@ -67,39 +153,1461 @@ class Artist(db.Model):
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable = False)
     image_link = db.Column(db.String(500), nullable=False)
-    genres = db.Column(db.ARRAY(db.String),nullable=False)
+    genres = db.Column(ARRAY(db.String),nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False, default="No Facebook page")
     website = db.Column(db.String(120), nullable=False, default="No Website")
     seeking_venues = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(250), nullable=False, default="Not currently seeking performance venues")
-    show_info = db.relationship('Shows', cascade="all, delete-orphan", backref='artists', primaryjoin=id ==Shows.artist_id)
+    show_info = db.relationship('Shows', cascade="all, delete-orphan", passive_deletes=True, backref='artists', primaryjoin=id ==Shows.artist_id)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    schedule_changed_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+    name_bands = db.Column(ARRAY(db.BigInteger))
+
+    __table_args__ = (
+        db.Index('ix_artists_genres', 'genres', postgresql_using='gin'),
+        db.Index('ix_artists_state', 'state'),
+        db.Index('ix_artists_dedup_block', 'state', db.func.lower(city)),
+        db.Index('ix_artists_name_bands', 'name_bands', postgresql_using='gin'),
+    )
 
     def __repr(self):
         return f'<Artist ID: {self.id}, name: {self.name}>'
 
 
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False)
+    payload = db.Column(JSONB, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=5)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_jobs_ready', 'run_at', postgresql_where=db.text("status = 'queued'")),
+        db.Index('ix_jobs_running', 'locked_at', postgresql_where=db.text("status = 'running'")),
+    )
+
+    def __repr__(self):
+        return f'<Job ID: {self.id}, name: {self.name}, status: {self.status}>'
+
+
+class ShowRollup(db.Model):
+    __tablename__ = 'show_rollups'
+
+    # e.g. ('month', 2021-03-01, 'genre', 'Jazz') -> 12 shows
+    period = db.Column(db.String(10), primary_key=True)
+    bucket = db.Column(db.Date, primary_key=True)
+    dimension = db.Column(db.String(20), primary_key=True)
+    key = db.Column(db.String, primary_key=True)
+    show_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.Index('ix_show_rollups_dimension', 'period', 'dimension', 'bucket'),
+    )
+
+    def __repr__(self):
+        return f'<ShowRollup {self.period} {self.bucket} {self.dimension}={self.key}: {self.show_count}>'
+
+
+class CatalogChange(db.Model):
+    __tablename__ = 'catalog_changes'
+
+    # appended by every write to venues/artists; workers holding a catalog
+    # snapshot poll it to find what to reload
+    id = db.Column(db.BigInteger, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now(), index=True)
+
+    def __repr__(self):
+        return f'<CatalogChange {self.id}: {self.kind} {self.entity_id}>'
+
+class DuplicateCandidate(db.Model):
+    __tablename__ = 'duplicate_candidates'
+    # a pair of venues or artists that look like the same one, found when
+    # one was listed or by the scan_duplicates job; entity_id < duplicate_id
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(10), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    duplicate_id = db.Column(db.Integer, nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    dismissed = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    found_at = db.Column(db.DateTime(timezone=True), nullable=False, server_default=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('kind', 'entity_id', 'duplicate_id', name='uq_duplicate_candidates_pair'),
+    )
+
+    def __repr__(self):
+        return f'<DuplicateCandidate {self.kind} {self.entity_id} ~ {self.duplicate_id}: {self.score:.2f}>'
+
+class RateLimit(db.Model):
+    __tablename__ = 'rate_limits'
+    # shared token buckets (RATE_LIMIT_BACKEND = 'postgres'): the time each
+    # client's bucket is full again. Unlogged, losing it on a crash only
+    # resets the limits.
+    __table_args__ = {'prefixes': ['UNLOGGED']}
+
+    key = db.Column(db.String(), primary_key=True)
+    tat = db.Column(db.DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return f'<RateLimit {self.key}: {self.tat}>'
+
+
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+datetime_formats = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
 def format_datetime(value, format='medium'):
-  date = dateutil.parser.parse(value)
-  if format == 'full':
-      format="EEEE MMMM, d, y 'at' h:mma"
-  elif format == 'medium':
-      format="EE MM, dd, y h:mma"
-  return babel.dates.format_datetime(date, format)
+  # the controllers pass datetimes straight from the query; only strings
+  # still go through dateutil, which costs several times the formatting
+  if not isinstance(value, datetime):
+      value = dateutil.parser.parse(value)
+  return format_datetime_cached(value, format)
+
+@lru_cache(maxsize=4096)
+def format_datetime_cached(value, format):
+  # listings repeat the same start times (residencies, popular slots)
+  return babel.dates.format_datetime(value, datetime_formats.get(format, format))
 
 app.jinja_env.filters['datetime'] = format_datetime
 
+#----------------------------------------------------------------------------#
+# Background jobs.
+#----------------------------------------------------------------------------#
+
+# name -> (function, max running at once across all workers or None)
+job_handlers = {}
+
+def job(name, concurrency=None):
+    def register(function):
+        job_handlers[name] = (function, concurrency)
+        return function
+    return register
+
+def enqueue(name, delay=0, max_attempts=5, **payload):
+    # added to the caller's session so the job commits (or rolls back) with the write
+    queued = Job(name=name, payload=payload, max_attempts=max_attempts,
+        run_at=datetime.utcnow() + timedelta(seconds=delay))
+    db.session.add(queued)
+    return queued
+
+def claim_job():
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=app.config['JOB_TIMEOUT'])
+    running = Job.query.filter(Job.status == 'running', Job.locked_at >= stale)
+    saturated = {name for name, count in running.with_entities(Job.name, db.func.count(Job.id)).group_by(Job.name)
+        if name in job_handlers and job_handlers[name][1] is not None and count >= job_handlers[name][1]}
+    while True:
+        # SKIP LOCKED lets any number of workers poll the same table without
+        # blocking on each other; running jobs whose worker died are picked up again
+        query = Job.query.filter(db.or_(
+            db.and_(Job.status == 'queued', Job.run_at <= now),
+            db.and_(Job.status == 'running', Job.locked_at < stale)
+        ))
+        if saturated:
+            query = query.filter(Job.name.notin_(saturated))
+        claimed = query.order_by(Job.run_at, Job.id).with_for_update(skip_locked=True).first()
+        if claimed is None:
+            break
+        concurrency = job_handlers[claimed.name][1] if claimed.name in job_handlers else None
+        if concurrency is None:
+            break
+        # capped jobs are counted and claimed under a per-name lock held
+        # until commit, so two workers can't both see room for one more.
+        # Never waited for: a name another worker is claiming counts as
+        # full, and it is let go (with the row) before trying the next
+        # name, so no worker holds one name's lock while taking another's.
+        locked = db.session.execute(db.select(db.func.pg_try_advisory_xact_lock(db.func.hashtext(claimed.name)))).scalar()
+        if locked and running.filter(Job.name == claimed.name).count() < concurrency:
+            break
+        saturated.add(claimed.name)
+        db.session.rollback()
+    if claimed is not None:
+        claimed.status = 'running'
+        claimed.locked_at = now
+        claimed.attempts += 1
+    db.session.commit()
+    return claimed
+
+def run_job(claimed):
+    job_id = claimed.id
+    try:
+        function = job_handlers[claimed.name][0]
+        function(**claimed.payload)
+        if db.session.query(Job).filter_by(id=job_id, status='running').update({'status': 'done', 'last_error': None}):
+            db.session.commit()
+        else:
+            # finished for it while it ran, e.g. drained by a rollup recount
+            db.session.rollback()
+    except Exception:
+        error = traceback.format_exc()
+        db.session.rollback()
+        try:
+            failed = Job.query.get(job_id)
+            failed.last_error = error
+            if failed.attempts >= failed.max_attempts:
+                failed.status = 'failed'
+            else:
+                # exponential backoff: 2, 4, 8, ... seconds
+                failed.status = 'queued'
+                failed.run_at = datetime.utcnow() + timedelta(seconds=2 ** failed.attempts)
+            db.session.commit()
+            app.logger.error('Job %s (%s) failed on attempt %s', job_id, failed.name, failed.attempts)
+        except Exception:
+            # the database went away too; the job is retried after JOB_TIMEOUT
+            db.session.rollback()
+            app.logger.exception('Job %s failed and could not be marked as failed', job_id)
+    finally:
+        db.session.remove()
+
+def work(burst=False, stop=None):
+    with app.app_context():
+        while stop is None or not stop.is_set():
+            try:
+                claimed = claim_job()
+            except Exception:
+                # a dropped connection or failover: keep the thread, start over on a clean session
+                db.session.remove()
+                app.logger.exception('Claiming a job failed')
+                time.sleep(app.config['JOB_POLL_INTERVAL'])
+                continue
+            if claimed is None:
+                db.session.remove()
+                if burst:
+                    return
+                time.sleep(app.config['JOB_POLL_INTERVAL'])
+                continue
+            run_job(claimed)
+
+@app.cli.group('jobs')
+def jobs_cli():
+    """Background job queue."""
+
+@jobs_cli.command('work')
+@click.option('--concurrency', default=1, show_default=True, help='Worker threads in this process.')
+@click.option('--burst', is_flag=True, help='Exit once the queue is empty.')
+def work_command(concurrency, burst):
+    stop = threading.Event()
+    threads = [threading.Thread(target=work, args=(burst, stop), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(1)
+    except KeyboardInterrupt:
+        # let running jobs finish, claimed-but-unfinished ones are retried after JOB_TIMEOUT
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+@jobs_cli.command('prune')
+@click.option('--days', default=7, show_default=True, help='Delete finished jobs older than this.')
+def prune_command(days):
+    deleted = Job.query.filter(Job.status == 'done',
+        Job.created_at < datetime.utcnow() - timedelta(days=days)).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} finished jobs')
+
+#----------------------------------------------------------------------------#
+# Faceted filtering.
+#----------------------------------------------------------------------------#
+
+genre_values = [value for value, label in genre_choices]
+state_values = [value for value, label in state_choices]
+
+def parse_filters(values):
+    # filters come from the query string on listings and from the posted form on searches
+    genres = [genre for genre in values.getlist('genre') if genre in genre_values]
+    state = values.get('state', '')
+    seeking = values.get('seeking', '')
+    return {
+        'genres': genres,
+        'genre_match': 'all' if values.get('genre_match') == 'all' else 'any',
+        'state': state if state in state_values else None,
+        'seeking': {'true': True, 'false': False}.get(seeking.lower()),
+    }
+
+def seeking_column(model):
+    return model.seeking_talent if model is Venue else model.seeking_venues
+
+def apply_filters(query, model, filters):
+    # genre predicates use the array operators so the GIN indexes can serve them
+    if filters['genres']:
+        if filters['genre_match'] == 'all':
+            query = query.filter(model.genres.contains(filters['genres']))
+        else:
+            query = query.filter(model.genres.overlap(filters['genres']))
+    if filters['state']:
+        query = query.filter(model.state == filters['state'])
+    if filters['seeking'] is not None:
+        query = query.filter(seeking_column(model) == filters['seeking'])
+    return query
+
+def delete_entities(model, ids):
+    # a single DELETE; their shows go with them through ON DELETE CASCADE
+    # in the database instead of being loaded and deleted one at a time
+    return db.session.execute(
+        db.delete(model).where(model.id.in_(ids)).returning(model.id, model.name)
+    ).all()
+
+def facet_counts(query, model):
+    # one aggregate over the filtered rows: GROUPING SETS gives the per-genre
+    # and per-state counts together instead of a query per facet
+    rows = query.with_entities(
+        model.id.label('id'),
+        model.state.label('state'),
+        db.func.unnest(model.genres).label('genre')
+    ).subquery()
+    counts = db.session.query(
+        db.func.grouping(rows.c.genre).label('by_state'),
+        rows.c.genre,
+        rows.c.state,
+        db.func.count(db.distinct(rows.c.id))
+    ).group_by(
+        db.func.grouping_sets(db.tuple_(rows.c.genre), db.tuple_(rows.c.state))
+    ).all()
+    genres = {}
+    states = {}
+    for by_state, genre, state, count in counts:
+        if by_state:
+            states[state] = count
+        else:
+            genres[genre] = count
+    return {
+        'genres': [(value, genres[value]) for value in genre_values if value in genres],
+        'states': [(value, states[value]) for value in sorted(states)],
+    }
+
+#----------------------------------------------------------------------------#
+# Show partitions.
+#----------------------------------------------------------------------------#
+
+# shows is range partitioned by month of start_time; months this worker
+# already knows to have a partition
+show_partitions = set()
+show_partition_name = re.compile(r'shows_y(\d{4})m(0[1-9]|1[0-2])')
+
+def in_period(query, period, now):
+    # comparing start_time with a bound value lets the planner prune to the
+    # partitions on that side of now instead of scanning the whole history
+    if period == 'upcoming':
+        return query.filter(Shows.start_time > now).order_by(Shows.start_time)
+    return query.filter(Shows.start_time <= now).order_by(Shows.start_time.desc())
+
+def show_row(show):
+    # start_time stays a datetime for the |datetime filter
+    return show._asdict()
+
+def shows_query():
+    return db.session.query(
+        Shows.id.label('show_id'),
+        Shows.start_time,
+        Shows.series_id,
+        Shows.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Shows.venue_id,
+        Venue.name.label('venue_name')
+    ).join(Artist, Artist.id == Shows.artist_id).join(Venue, Venue.id == Shows.venue_id)
+
+def month_of(moment):
+    return date(moment.year, moment.month, 1)
+
+def add_months(month, count):
+    month_index = month.year * 12 + month.month - 1 + count
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+def archive_cutoff():
+    # the oldest month still kept in the database, earlier ones are archived
+    return add_months(month_of(datetime.now()), -app.config['SHOW_ARCHIVE_AFTER_MONTHS'])
+
+def partition_horizon():
+    # the last month maintenance keeps a partition ready for
+    return add_months(month_of(datetime.now()), app.config['SHOW_PARTITION_MONTHS_AHEAD'])
+
+def partition_problems(start_times):
+    # checked before ensure_show_partitions: an archived month must never be
+    # created again, the next maintenance run would archive it a second time,
+    # and months past the ones maintenance creates would each lock shows
+    if not start_times:
+        return []
+    cutoff = archive_cutoff()
+    if month_of(min(start_times)) < cutoff:
+        return [f'Shows before {cutoff:%B %Y} are archived, no new shows can be listed then']
+    horizon = partition_horizon()
+    if month_of(max(start_times)) > horizon:
+        return [f'Shows can be listed up to the end of {horizon:%B %Y}']
+    return []
+
+def ensure_show_partitions(start_times):
+    # created on a separate connection so the partition survives even if the
+    # caller's transaction rolls back
+    months = {month_of(start_time) for start_time in start_times} - show_partitions
+    if months and min(months) < archive_cutoff():
+        raise ValueError(f'Show partition for {min(months):%Y-%m} was archived')
+    if months and max(months) > partition_horizon():
+        raise ValueError(f'Show partition for {max(months):%Y-%m} is past SHOW_PARTITION_MONTHS_AHEAD')
+    if months:
+        with db.engine.begin() as connection:
+            for month in sorted(months):
+                connection.execute(db.text('SELECT create_shows_partition(:month)'), {'month': month})
+        show_partitions.update(months)
+
+def attached_show_partitions():
+    rows = db.session.execute(db.text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = 'shows'::regclass"
+    )).scalars().all()
+    # only the monthly partitions create_shows_partition makes; anything else
+    # attached by hand (a default partition, say) is left alone
+    months = [(show_partition_name.fullmatch(name), name) for name in rows]
+    return sorted((date(int(match[1]), int(match[2]), 1), name) for match, name in months if match)
+
+def archive_show_partition(name):
+    # dump as gzipped CSV first, then detach and drop in one short
+    # transaction so the parent is only locked for the catalog change
+    os.makedirs(app.config['SHOW_ARCHIVE_DIR'], exist_ok=True)
+    partial = os.path.join(app.config['SHOW_ARCHIVE_DIR'], name + '.csv.gz.partial')
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        with gzip.open(partial, 'wt', newline='') as archive:
+            cursor.copy_expert(f'COPY "{name}" TO STDOUT WITH CSV HEADER', archive)
+        connection.commit()
+        # an existing archive is never replaced: linking fails if the name
+        # is taken, so a month archived twice gets name.1.csv.gz and so on
+        for attempt in itertools.count():
+            path = os.path.join(app.config['SHOW_ARCHIVE_DIR'], name + (f'.{attempt}' if attempt else '') + '.csv.gz')
+            try:
+                os.link(partial, path)
+                break
+            except FileExistsError:
+                continue
+        os.remove(partial)
+        cursor.execute(f'ALTER TABLE shows DETACH PARTITION "{name}"')
+        cursor.execute(f'DROP TABLE "{name}"')
+        connection.commit()
+    finally:
+        connection.close()
+    return path
+
+@job('maintain_show_partitions', concurrency=1)
+def maintain_show_partitions():
+    this_month = month_of(datetime.now())
+    ensure_show_partitions(add_months(this_month, offset) for offset in range(app.config['SHOW_PARTITION_MONTHS_AHEAD'] + 1))
+    cutoff = add_months(this_month, -app.config['SHOW_ARCHIVE_AFTER_MONTHS'])
+    for month, name in attached_show_partitions():
+        if month < cutoff:
+            app.logger.info('Archived show partition %s to %s', name, archive_show_partition(name))
+
+@app.cli.group('shows')
+def shows_cli():
+    """Show partition maintenance."""
+
+@shows_cli.command('maintain')
+def maintain_command():
+    maintain_show_partitions()
+    for month, name in attached_show_partitions():
+        click.echo(name)
+
+#----------------------------------------------------------------------------#
+# Analytics export.
+#----------------------------------------------------------------------------#
+
+@app.cli.command('export')
+@click.option('--out', default=os.path.join(app.root_path, 'exports'), show_default=True,
+    type=click.Path(file_okay=False), help='Directory the files are written to.')
+@click.option('--format', 'format', type=click.Choice(export.FORMATS), default='parquet', show_default=True,
+    help='Parquet and Arrow need pyarrow, otherwise gzipped CSV is written.')
+@click.option('--chunk-size', default=50000, show_default=True, help='Rows fetched and written per file.')
+@click.option('--full', is_flag=True, help='Ignore the watermarks and export every row again.')
+@click.option('--recheck-hours', default=24, show_default=True,
+    help='How long ids missing below the watermark are looked for again.')
+def export_command(out, format, chunk_size, full, recheck_hours):
+    """Export venues, artists and shows for analytics.
+
+    Rows are streamed from a server-side cursor in chunks and only rows with
+    an id above the last run's watermark are exported, plus any that turned
+    up in the gaps below it (ids of transactions that committed late) for
+    --recheck-hours. Each row is exported once. Shows are written under
+    shows/month=YYYY-MM/ by month of start_time.
+    """
+    format = export.available_format(format)
+    watermarks = {} if full else export.load_watermarks(out)
+    started = datetime.utcnow()
+    run = started.strftime('%Y%m%dT%H%M%S')
+    recheck_since = (started - timedelta(hours=recheck_hours)).isoformat()
+    for model in (Venue, Artist, Shows):
+        table = model.__table__
+        if full:
+            shutil.rmtree(os.path.join(out, table.name), ignore_errors=True)
+        mark = watermarks.get(table.name, {'id': 0, 'gaps': []})
+        watermark = mark['id']
+        gaps = [gap for gap in mark['gaps'] if gap[2] >= recheck_since]
+        columns = [column.name for column in table.columns]
+        statement = db.select(table).where(db.or_(table.c.id > watermark,
+            *(table.c.id.between(first, last) for first, last, seen_at in gaps))).order_by(table.c.id)
+        exported = 0
+        filled = []
+        new_gaps = []
+        with db.engine.connect() as connection:
+            result = connection.execution_options(stream_results=True).execute(statement)
+            for part, rows in enumerate(result.partitions(chunk_size)):
+                if model is Shows:
+                    months = {}
+                    for row in rows:
+                        months.setdefault(row.start_time.strftime('%Y-%m'), []).append(row)
+                    for month, month_rows in months.items():
+                        export.write_chunk(os.path.join(out, table.name, 'month=' + month, f'part-{run}-{part:05d}'),
+                            columns, month_rows, format)
+                else:
+                    export.write_chunk(os.path.join(out, table.name, f'part-{run}-{part:05d}'), columns, rows, format)
+                exported += len(rows)
+                filled.extend(row.id for row in rows if row.id <= mark['id'])
+                new_gaps.extend(export.find_gaps([row.id for row in rows if row.id > watermark], watermark,
+                    started.isoformat()))
+                watermark = max(watermark, rows[-1].id)
+        # saved per table so an interrupted run resumes where it stopped
+        watermarks[table.name] = {'id': watermark, 'gaps': export.remaining_gaps(gaps, filled) + new_gaps}
+        export.save_watermarks(out, watermarks)
+        click.echo(f'{table.name}: exported {exported} rows as {format}, watermark id {watermark}, '
+            f'{len(filled)} from earlier gaps')
+
+#----------------------------------------------------------------------------#
+# Show rollups.
+#----------------------------------------------------------------------------#
+
+def rollup_source():
+    # one row per show, columns in analytics.COLUMNS order
+    return db.session.query(Shows.start_time, Shows.venue_id, Shows.artist_id,
+        Venue.city, Venue.state, Venue.genres).join(Venue, Venue.id == Shows.venue_id)
+
+def rollup_records(counts):
+    return [{'period': period, 'bucket': bucket, 'dimension': dimension, 'key': key, 'show_count': count}
+        for (period, bucket, dimension, key), count in counts.items()]
+
+def lock_rollups(exclusive=False):
+    # increments share this lock and a recount takes it alone, so a recount
+    # never runs between a transaction's new shows and its increment
+    lock = db.func.pg_advisory_xact_lock if exclusive else db.func.pg_advisory_xact_lock_shared
+    db.session.execute(db.select(lock(db.func.hashtext('show_rollups'))))
+
+def add_to_rollups(counts):
+    if not counts:
+        return
+    lock_rollups()
+    table = ShowRollup.__table__
+    statement = pg_insert(table).values(rollup_records(counts))
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.period, table.c.bucket, table.c.dimension, table.c.key],
+        set_={'show_count': table.c.show_count + statement.excluded.show_count}
+    ))
+
+@job('show_listed')
+def show_listed(show_id, start_time=None):
+    query = rollup_source().filter(Shows.id == show_id)
+    if start_time:
+        # lets the lookup prune to the show's partition
+        query = query.filter(Shows.start_time == dateutil.parser.parse(start_time))
+    add_to_rollups(analytics.count_rollups(query.all()))
+
+@job('rebuild_show_rollups', concurrency=1)
+def rebuild_show_rollups(batch_size=100000):
+    # recount the months still in shows; also the way to pick up deleted
+    # shows, which the incremental path does not subtract. Buckets before
+    # the oldest partition keep the counts of the archived shows.
+    # creates hold the shared lock until their show and show_listed job
+    # commit, so none commits between the drain and the count below
+    lock_rollups(exclusive=True)
+    partitions = attached_show_partitions()
+    since = partitions[0][0] if partitions else date.max
+    # every listed show is in the recount, the jobs that would add them again are done
+    db.session.query(Job).filter(Job.name == 'show_listed', Job.status.in_(['queued', 'running'])) \
+        .update({'status': 'done'}, synchronize_session=False)
+    counts = Counter()
+    statement = rollup_source().filter(Shows.start_time >= since).statement.execution_options(stream_results=True)
+    for rows in db.session.execute(statement).partitions(batch_size):
+        counts.update(analytics.count_rollups(rows))
+    db.session.query(ShowRollup).filter(ShowRollup.bucket >= since).delete(synchronize_session=False)
+    records = rollup_records(counts)
+    for start in range(0, len(records), batch_size):
+        db.session.execute(ShowRollup.__table__.insert(), records[start:start + batch_size])
+    return len(records)
+
+@app.cli.group('stats')
+def stats_cli():
+    """Show statistics rollups."""
+
+@stats_cli.command('backfill')
+def backfill_command():
+    cells = rebuild_show_rollups()
+    db.session.commit()
+    click.echo(f'Rebuilt {cells} rollup cells')
+
+def rollup_totals(dimension, period, start, end, limit=None):
+    query = db.session.query(ShowRollup.key, db.func.sum(ShowRollup.show_count).label('shows')) \
+        .filter(ShowRollup.period == period, ShowRollup.dimension == dimension,
+            ShowRollup.bucket >= start, ShowRollup.bucket < end) \
+        .group_by(ShowRollup.key).order_by(db.desc('shows'), ShowRollup.key)
+    return query.limit(limit).all() if limit else query.all()
+
+def rollup_series(dimension, key, period, start, end):
+    return db.session.query(ShowRollup.bucket, ShowRollup.show_count) \
+        .filter(ShowRollup.period == period, ShowRollup.dimension == dimension, ShowRollup.key == key,
+            ShowRollup.bucket >= start, ShowRollup.bucket < end) \
+        .order_by(ShowRollup.bucket).all()
+
+#----------------------------------------------------------------------------#
+# Show events.
+#----------------------------------------------------------------------------#
+
+# newly listed shows, fanned out to the /shows/stream subscribers of this worker
+show_broker = Broker(size=app.config['SHOW_EVENTS_BUFFER'])
+show_listener = None
+show_listener_lock = threading.Lock()
+
+def show_event_query():
+    return db.session.query(
+        Shows.id,
+        Shows.start_time,
+        Shows.artist_id,
+        Artist.name.label('artist_name'),
+        Artist.image_link.label('artist_image_link'),
+        Shows.venue_id,
+        Venue.name.label('venue_name'),
+        Venue.city,
+        Venue.state
+    ).join(Artist, Artist.id == Shows.artist_id).join(Venue, Venue.id == Shows.venue_id)
+
+def show_event(row):
+    event = row._asdict()
+    event['start_time'] = row.start_time.isoformat()
+    return event
+
+def queue_show_event(event):
+    # with the postgres backend NOTIFY is part of the creating transaction,
+    # so every worker's listener hears about the show only once it commits
+    if app.config['SHOW_EVENTS_BACKEND'] == 'postgres':
+        db.session.execute(db.text('SELECT pg_notify(:channel, :payload)'),
+            {'channel': 'shows', 'payload': json.dumps(event)})
+
+def publish_show_event(event):
+    # called after commit; the local backend only reaches this worker
+    if app.config['SHOW_EVENTS_BACKEND'] != 'postgres':
+        show_broker.publish(event)
+
+def listen_for_shows():
+    while True:
+        connection = None
+        try:
+            # a thread of its own, so it needs its own context to reach the engine
+            with app.app_context():
+                connection = db.engine.raw_connection()
+            connection.detach()
+            listener = connection.dbapi_connection
+            listener.autocommit = True
+            listener.cursor().execute('LISTEN shows')
+            while True:
+                readable, writable, errored = select.select([listener], [], [], 60)
+                if readable:
+                    listener.poll()
+                    while listener.notifies:
+                        show_broker.publish(json.loads(listener.notifies.pop(0).payload))
+        except Exception:
+            app.logger.exception('Show event listener lost its connection, reconnecting')
+            if connection is not None:
+                connection.close()
+            time.sleep(5)
+
+def ensure_show_listener():
+    # started lazily so it runs in the serving worker, never in a parent
+    # process that forks afterwards
+    global show_listener
+    if app.config['SHOW_EVENTS_BACKEND'] != 'postgres':
+        return
+    with show_listener_lock:
+        if show_listener is None or not show_listener.is_alive():
+            show_listener = threading.Thread(target=listen_for_shows, name='show-listener', daemon=True)
+            show_listener.start()
+
+def show_event_filters(args):
+    filters = {}
+    for key in ('venue_id', 'artist_id'):
+        if args.get(key, type=int) is not None:
+            filters[key] = args.get(key, type=int)
+    for key in ('city', 'state'):
+        if args.get(key):
+            filters[key] = args.get(key).casefold()
+    return filters
+
+def filter_show_query(query, filters):
+    if 'venue_id' in filters:
+        query = query.filter(Shows.venue_id == filters['venue_id'])
+    if 'artist_id' in filters:
+        query = query.filter(Shows.artist_id == filters['artist_id'])
+    if 'city' in filters:
+        query = query.filter(db.func.lower(Venue.city) == filters['city'])
+    if 'state' in filters:
+        query = query.filter(db.func.lower(Venue.state) == filters['state'])
+    return query
+
+def event_matches(event, filters):
+    for key, value in filters.items():
+        if (event[key].casefold() if isinstance(value, str) else event[key]) != value:
+            return False
+    return True
+
+def format_show_event(event):
+    return f'id: {event["id"]}\nevent: show\ndata: {json.dumps(event)}\n\n'
+
+#----------------------------------------------------------------------------#
+# Recurring shows.
+#----------------------------------------------------------------------------#
+
+def schedule_clash_times(column):
+    # requested start times within SHOW_CLASH_HOURS of another show with the
+    # same value in column; the range join keeps to ix_shows_start_time
+    # and the partitions those times fall in
+    return f'''ARRAY(
+        SELECT DISTINCT requested.start_time
+        FROM unnest(CAST(:start_times AS timestamp[])) AS requested(start_time)
+        JOIN shows ON shows.start_time > requested.start_time - :window
+            AND shows.start_time < requested.start_time + :window
+        WHERE shows.{column} = :{column}
+            AND (CAST(:series_id AS integer) IS NULL OR shows.series_id IS DISTINCT FROM :series_id)
+        ORDER BY 1
+    )'''
+
+def schedule_problems(venue_id, artist_id, start_times, series_id=None):
+    """Reasons start_times can't be booked for the venue and artist, checked in one query.
+
+    Only the artist can't be in two places at once; a venue can have several
+    acts on a night. Shows of series_id are ignored, so a series can be moved
+    over its own dates.
+    """
+    row = db.session.execute(db.text(f'''
+        SELECT
+            (SELECT name FROM venues WHERE id = :venue_id) AS venue_name,
+            (SELECT name FROM artists WHERE id = :artist_id) AS artist_name,
+            {schedule_clash_times('artist_id')} AS artist_clashes
+    '''), {
+        'venue_id': venue_id,
+        'artist_id': artist_id,
+        'start_times': list(start_times),
+        'series_id': series_id,
+        'window': timedelta(hours=app.config['SHOW_CLASH_HOURS']),
+    }).one()
+    problems = []
+    if row.venue_name is None:
+        problems.append(f'There is no venue with ID {venue_id}')
+    if row.artist_name is None:
+        problems.append(f'There is no artist with ID {artist_id}')
+    for start_time in row.artist_clashes:
+        problems.append(f'{row.artist_name} already has a show around {start_time:%Y-%m-%d %H:%M}')
+    return problems
+
+def insert_shows(venue_id, artist_id, start_times, series_id=None):
+    # one multi-row INSERT however many dates there are. Call
+    # ensure_show_partitions before this transaction touches shows at all:
+    # creating a partition locks shows and the tables it references.
+    table = Shows.__table__
+    return db.session.execute(table.insert().values([
+        {'venue_id': venue_id, 'artist_id': artist_id, 'start_time': start_time, 'series_id': series_id}
+        for start_time in start_times
+    ]).returning(table.c.id, table.c.start_time)).all()
+
+def series_shows(query, series_id):
+    return query.filter(Shows.series_id == series_id)
+
+def upcoming_series_rollups(series_id, now):
+    return analytics.count_rollups(in_period(series_shows(rollup_source(), series_id), 'upcoming', now).all())
+
+def adjust_rollups(before, after):
+    # rollups of the shows a set-based change touched, recounted from
+    # before and after the change instead of waiting for a backfill
+    delta = Counter(after)
+    delta.subtract(before)
+    add_to_rollups({cell: count for cell, count in delta.items() if count})
+    emptied = {(period, bucket) for (period, bucket, dimension, key), count in delta.items() if count < 0}
+    if emptied:
+        db.session.execute(ShowRollup.__table__.delete().where(ShowRollup.show_count == 0,
+            db.tuple_(ShowRollup.period, ShowRollup.bucket).in_(emptied)))
+
+#----------------------------------------------------------------------------#
+# Duplicate detection.
+#----------------------------------------------------------------------------#
+
+def dedup_columns(model):
+    # in dedup.Record argument order; artists have no address
+    address = model.address if model is Venue else db.null()
+    return [model.id, model.name, address, model.phone]
+
+def likely_duplicates(model, entity):
+    """(score, dedup.Record) for the entities entity looks like, best first.
+
+    Only the ones in its city sharing an LSH bucket with its name are
+    fetched and scored, a lookup on ix_*_name_bands rather than a scan of
+    the city. entity.name_bands has to be set.
+    """
+    record = dedup.Record(entity.id, entity.name, getattr(entity, 'address', None), entity.phone)
+    candidates = [dedup.Record(*row) for row in db.session.query(*dedup_columns(model))
+        .filter(model.name_bands.overlap(entity.name_bands),
+            model.state == entity.state, db.func.lower(model.city) == db.func.lower(entity.city))]
+    return dedup.matches(record, candidates, app.config['DEDUP_THRESHOLD'])
+
+def fill_name_bands(model, batch_size=1000):
+    # rows from before name_bands existed
+    while True:
+        rows = db.session.query(model.id, model.name).filter(model.name_bands.is_(None)).limit(batch_size).all()
+        if not rows:
+            return
+        db.session.execute(db.update(model), [{'id': entity_id, 'name_bands': dedup.name_bands(name)}
+            for entity_id, name in rows])
+
+def flash_duplicates(label, duplicates):
+    for score, other in duplicates[:3]:
+        flash(label + ' looks like ' + other.name + ' (ID ' + str(other.id) + '), see Duplicates to merge them.')
+
+def save_duplicates(kind, pairs):
+    # pairs of (score, lower id, higher id); pairs found again keep being
+    # dismissed if they were
+    if not pairs:
+        return
+    table = DuplicateCandidate.__table__
+    statement = pg_insert(table).values([{'kind': kind, 'entity_id': entity_id, 'duplicate_id': duplicate_id,
+        'score': score} for score, entity_id, duplicate_id in pairs])
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.kind, table.c.entity_id, table.c.duplicate_id],
+        set_={'score': statement.excluded.score}
+    ))
+
+@job('scan_duplicates', concurrency=1)
+def scan_duplicates(kind):
+    # rows come sorted by block, so only one city is held at a time
+    model = Venue if kind == 'venue' else Artist
+    fill_name_bands(model)
+    block_key = (model.state, db.func.lower(model.city))
+    rows = db.session.query(*block_key, *dedup_columns(model)).order_by(*block_key).yield_per(10000)
+    pairs = []
+    for block, block_rows in itertools.groupby(rows, key=lambda row: row[:2]):
+        found = dedup.duplicate_pairs([dedup.Record(*row[2:]) for row in block_rows], app.config['DEDUP_THRESHOLD'])
+        pairs.extend((score, a.id, b.id) for score, a, b in found)
+    for i in range(0, len(pairs), 1000):
+        save_duplicates(kind, pairs[i:i + 1000])
+    return len(pairs)
+
+def merge_entities(model, duplicate_id, into_id):
+    """Fold duplicate_id into into_id and delete it; returns how many shows moved.
+
+    Its shows and series are re-pointed with one UPDATE each.
+    """
+    kind = 'venue' if model is Venue else 'artist'
+    column = Shows.venue_id if model is Venue else Shows.artist_id
+    series_column = ShowSeries.venue_id if model is Venue else ShowSeries.artist_id
+    before = analytics.count_rollups(rollup_source().filter(column.in_([duplicate_id, into_id])).all())
+    moved = db.session.execute(Shows.__table__.update()
+        .where(column == duplicate_id).values({column.key: into_id})).rowcount
+    db.session.execute(ShowSeries.__table__.update()
+        .where(series_column == duplicate_id).values({series_column.key: into_id}))
+    adjust_rollups(before, analytics.count_rollups(rollup_source().filter(column == into_id).all()))
+    touch_related_schedules(model, [into_id])
+    delete_entities(model, [duplicate_id])
+    db.session.execute(DuplicateCandidate.__table__.delete().where(DuplicateCandidate.kind == kind,
+        (DuplicateCandidate.entity_id == duplicate_id) | (DuplicateCandidate.duplicate_id == duplicate_id)))
+    record_changes(kind, [duplicate_id])
+    return moved
+
+@app.cli.group('dedup')
+def dedup_cli():
+    """Duplicate venue and artist detection."""
+
+@dedup_cli.command('scan')
+@click.option('--kind', type=click.Choice(['venue', 'artist', 'all']), default='all', show_default=True)
+def dedup_scan_command(kind):
+    for scanned in (['venue', 'artist'] if kind == 'all' else [kind]):
+        pairs = scan_duplicates(scanned)
+        db.session.commit()
+        click.echo(f'{pairs} likely duplicate {scanned} pairs')
+
+#----------------------------------------------------------------------------#
+# Calendar feeds.
+#----------------------------------------------------------------------------#
+
+# per-worker serialized feeds, each kept for the schedule_changed_at it was
+# built at; another worker's change bumps the stamp and so replaces it here
+calendar_feeds = ical.FeedCache(app.config['CALENDAR_CACHE_SIZE'])
+
+# venue and artist columns that appear in the other side's feeds
+calendar_fields = {'name', 'address', 'city', 'state'}
+
+def calendar_since():
+    return datetime.now() - timedelta(days=app.config['CALENDAR_PAST_DAYS'])
+
+def touch_schedules(model, ids):
+    # ids is a list or a SELECT of ids. Part of the caller's transaction,
+    # like record_changes, so a feed is invalidated exactly when its shows
+    # change
+    if isinstance(ids, list) and not ids:
+        return
+    db.session.execute(db.update(model).where(model.id.in_(ids)).values(schedule_changed_at=db.func.now()))
+
+def counterpart_ids(model, ids):
+    # the artists in the feeds of venues ids, or the venues in artists ids'
+    column, other = (Shows.venue_id, Shows.artist_id) if model is Venue else (Shows.artist_id, Shows.venue_id)
+    return db.select(other).where(column.in_(ids), Shows.start_time >= calendar_since()).distinct()
+
+def touch_related_schedules(model, ids):
+    # the feeds of ids and of everyone sharing a show with them, venues
+    # always before artists so concurrent writers lock rows in one order
+    if model is Venue:
+        touch_schedules(Venue, ids)
+        touch_schedules(Artist, counterpart_ids(Venue, ids))
+    else:
+        touch_schedules(Venue, counterpart_ids(Artist, ids))
+        touch_schedules(Artist, ids)
+
+def calendar_shows(model, entity_id):
+    column = Shows.venue_id if model is Venue else Shows.artist_id
+    return db.session.query(
+        Shows.id,
+        Shows.start_time,
+        Shows.artist_id,
+        Artist.name.label('artist_name'),
+        Shows.venue_id,
+        Venue.name.label('venue_name'),
+        Venue.address,
+        Venue.city,
+        Venue.state
+    ).join(Artist, Artist.id == Shows.artist_id).join(Venue, Venue.id == Shows.venue_id) \
+        .filter(column == entity_id, Shows.start_time >= calendar_since()).order_by(Shows.start_time)
+
+def calendar_stream(key, stamp, head, shows):
+    """Write the feed as the rows arrive, and cache it once it is complete."""
+    # DTSTAMP is the schedule stamp rather than the time of writing, so the
+    # same shows always give the same bytes
+    host = request.host
+    length = timedelta(hours=app.config['CALENDAR_SHOW_HOURS'])
+    body = []
+    pending = [head]
+    for show in shows.yield_per(1000):
+        pending.append(ical.event(
+            f'show-{show.id}@{host}', stamp, show.start_time, show.start_time + length,
+            f'{show.artist_name} at {show.venue_name}',
+            ', '.join((show.venue_name, show.address, show.city, show.state)),
+            url_for('show_artist', artist_id=show.artist_id, _external=True) if key[0] == 'venue'
+                else url_for('show_venue', venue_id=show.venue_id, _external=True)))
+        if len(pending) == 500:
+            body.append(''.join(pending).encode())
+            pending = []
+            yield body[-1]
+    pending.append(ical.FOOTER)
+    body.append(''.join(pending).encode())
+    yield body[-1]
+    calendar_feeds.put(key, stamp, b''.join(body))
+
+def calendar_response(model, entity_id):
+    kind = 'venue' if model is Venue else 'artist'
+    entity = db.session.query(model.name, model.city, model.state, model.schedule_changed_at) \
+        .filter(model.id == entity_id).first()
+    if entity is None:
+        abort(404)
+    stamp = entity.schedule_changed_at
+    # the shows are read after the stamp, so a feed is never older than the
+    # stamp it is cached and validated under
+    body = calendar_feeds.get((kind, entity_id), stamp)
+    if body is None:
+        description = (f'Shows at {entity.name}, ' if model is Venue else f'Shows by {entity.name}, ') \
+            + f'{entity.city}, {entity.state}'
+        body = stream_with_context(calendar_stream((kind, entity_id), stamp,
+            ical.header(entity.name, description), calendar_shows(model, entity_id)))
+    response = Response(body, mimetype='text/calendar')
+    # otherwise make_conditional reads the whole stream to set Content-Length
+    response.implicit_sequence_conversion = False
+    response.set_etag(f'{kind}-{entity_id}-{stamp.timestamp():.6f}')
+    response.last_modified = stamp
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['CALENDAR_MAX_AGE']
+    # clients polling with If-None-Match or If-Modified-Since get a 304
+    # and the body, cached or not, is never produced
+    return response.make_conditional(request)
+
+#----------------------------------------------------------------------------#
+# Sitemaps.
+#----------------------------------------------------------------------------#
+
+sitemap_models = {'venue': Venue, 'artist': Artist}
+
+def sitemap_lastmod(model):
+    # a detail page changes with the entity and with its shows
+    return db.func.greatest(model.updated_at, model.schedule_changed_at)
+
+def sitemap_fingerprints(model):
+    # one aggregate pass per table over the columns the urlsets are made
+    # of, to find the chunks that changed without reading them
+    chunk = model.id // sitemap.CHUNK_SIZE
+    return db.session.query(chunk, db.func.count(), db.func.sum(model.id), db.func.max(sitemap_lastmod(model))) \
+        .group_by(chunk).order_by(chunk).all()
+
+def sitemap_rows(model, start, end, batch_size=10000):
+    # keyset pagination on the primary key: each batch starts after the
+    # last id of the one before, so no batch re-reads skipped rows
+    last = start - 1
+    while True:
+        batch = db.session.query(model.id, sitemap_lastmod(model)) \
+            .filter(model.id > last, model.id < end).order_by(model.id).limit(batch_size).all()
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        last = batch[-1][0]
+
+@job('build_sitemaps', concurrency=1)
+def build_sitemaps(full=False):
+    """Rewrite the sitemap chunks that changed since the last run, and the index.
+
+    Returns (chunks written, chunks unchanged, chunks removed).
+    """
+    out = app.config['SITEMAP_DIR']
+    base_url = app.config['SITEMAP_BASE_URL'].rstrip('/')
+    os.makedirs(out, exist_ok=True)
+    previous = {} if full else sitemap.load_manifest(out)
+    manifest = {}
+    written = unchanged = 0
+    for kind, model in sitemap_models.items():
+        for chunk, count, id_sum, lastmod in sitemap_fingerprints(model):
+            name = sitemap.chunk_name(kind, chunk)
+            path = os.path.join(out, name)
+            # fingerprinted before the chunk is read: a change made while it
+            # is written shows up as a new fingerprint next run
+            manifest[name] = {'fingerprint': sitemap.fingerprint(count, id_sum, lastmod),
+                'lastmod': sitemap.format_lastmod(lastmod)}
+            if previous.get(name, {}).get('fingerprint') == manifest[name]['fingerprint'] and os.path.exists(path):
+                unchanged += 1
+                continue
+            sitemap.write_urlset(path, ((f'{base_url}/{kind}s/{entity_id}', entity_lastmod) for entity_id, entity_lastmod
+                in sitemap_rows(model, chunk * sitemap.CHUNK_SIZE, (chunk + 1) * sitemap.CHUNK_SIZE)))
+            written += 1
+    removed = [name for name in previous if name not in manifest]
+    for name in removed:
+        try:
+            os.remove(os.path.join(out, name))
+        except FileNotFoundError:
+            pass
+    sitemap.write_index(os.path.join(out, sitemap.INDEX_NAME),
+        [(f'{base_url}/sitemaps/{name}', manifest[name]['lastmod']) for name in sorted(manifest)])
+    sitemap.save_manifest(out, manifest)
+    return written, unchanged, len(removed)
+
+@app.cli.group('sitemap')
+def sitemap_cli():
+    """Sitemaps of the venue and artist pages."""
+
+@sitemap_cli.command('build')
+@click.option('--full', is_flag=True, help='Ignore the manifest and write every chunk again.')
+def sitemap_build_command(full):
+    written, unchanged, removed = build_sitemaps(full)
+    click.echo(f'{written} sitemap chunks written, {unchanged} unchanged, {removed} removed')
+
+#----------------------------------------------------------------------------#
+# What's on.
+#----------------------------------------------------------------------------#
+
+# query string arguments that turn /shows into date range browsing
+browse_args = ('from', 'to', 'city', 'state', 'genre', 'month')
+# dates are clamped to this, well clear of date.min and date.max for the
+# range and month arithmetic
+browse_range = (date(1900, 1, 1), date(2099, 12, 31))
+
+def parse_day(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+
+def clamp_day(day):
+    return min(max(day, browse_range[0]), browse_range[1])
+
+def browse_filters(args):
+    # a week from today unless given; ranges are capped at SHOWS_BROWSE_MAX_DAYS
+    start = clamp_day(parse_day(args.get('from')) or date.today())
+    end = clamp_day(parse_day(args.get('to')) or start + timedelta(days=6))
+    end = min(max(end, start), start + timedelta(days=app.config['SHOWS_BROWSE_MAX_DAYS'] - 1))
+    state = args.get('state', '').upper()
+    genre = args.get('genre', '')
+    return {
+        'from': start,
+        'to': end,
+        'city': args.get('city', '').strip() or None,
+        'state': state if state in state_values else None,
+        'genre': genre if genre in genre_values else None,
+    }
+
+def browse_shows(filters):
+    """[(day, shows that day, [show rows])] in the filters' range, and whether the list was cut short.
+
+    One query: the range on start_time keeps to ix_shows_start_time and the
+    month partitions it covers, and the per-day totals come from a window
+    count so days cut off by SHOWS_BROWSE_LIMIT still say how many shows
+    they have.
+    """
+    day = db.func.date_trunc('day', Shows.start_time)
+    query = shows_query().add_columns(db.func.count().over(partition_by=day).label('day_shows')) \
+        .filter(Shows.start_time >= datetime.combine(filters['from'], datetime.min.time()),
+            Shows.start_time < datetime.combine(filters['to'] + timedelta(days=1), datetime.min.time()))
+    if filters['city']:
+        # with a state this is a lookup on ix_venues_dedup_block
+        query = query.filter(db.func.lower(Venue.city) == filters['city'].lower())
+    if filters['state']:
+        query = query.filter(Venue.state == filters['state'])
+    if filters['genre']:
+        # venue genres, as in show_rollups, through ix_venues_genres
+        query = query.filter(Venue.genres.contains([filters['genre']]))
+    limit = app.config['SHOWS_BROWSE_LIMIT']
+    rows = query.order_by(Shows.start_time, Shows.id).limit(limit + 1).all()
+    days = []
+    for day, day_rows in itertools.groupby(rows[:limit], key=lambda row: row.start_time.date()):
+        day_rows = list(day_rows)
+        days.append((day, day_rows[0].day_shows, [show_row(row) for row in day_rows]))
+    return days, len(rows) > limit
+
+def calendar_cells(filters):
+    # the single show_rollups dimension closest to the filters: a city
+    # (in any state when none is given), a state, a genre or all shows
+    if filters['city'] and filters['state']:
+        return 'city', db.func.lower(ShowRollup.key) == analytics.city_key(filters['city'], filters['state']).lower()
+    if filters['city']:
+        return 'city', db.func.lower(ShowRollup.key).startswith(filters['city'].lower() + ', ', autoescape=True)
+    if filters['state']:
+        return 'state', ShowRollup.key == filters['state']
+    if filters['genre']:
+        return 'genre', ShowRollup.key == filters['genre']
+    return 'all', ShowRollup.key == ''
+
+def browse_url(filters, start, end, month=None):
+    # the same place and genre over another range (or month)
+    args = {name: filters[name] for name in ('city', 'state', 'genre') if filters[name]}
+    args.update({'from': start.isoformat(), 'to': end.isoformat()})
+    if month is not None:
+        args['month'] = month.strftime('%Y-%m')
+    return url_for('shows', **args)
+
+def month_calendar(month, filters):
+    """Weeks of (day, shows, url) for month from the daily rollups; days outside it have no count."""
+    dimension, key = calendar_cells(filters)
+    counts = dict(db.session.query(ShowRollup.bucket, db.func.sum(ShowRollup.show_count))
+        .filter(ShowRollup.period == 'day', ShowRollup.dimension == dimension, key,
+            ShowRollup.bucket >= month, ShowRollup.bucket < add_months(month, 1))
+        .group_by(ShowRollup.bucket))
+    return [[(day, counts.get(day, 0), browse_url(filters, day, day)) if day.month == month.month else (day, None, None)
+        for day in week] for week in Calendar().monthdatescalendar(month.year, month.month)]
+
+def browse_presets(filters, today):
+    # tonight, the coming (or current) Friday to Sunday, and the next week
+    weekday = today.weekday()
+    friday = today if weekday >= 4 else today + timedelta(days=4 - weekday)
+    return [(label, browse_url(filters, start, end)) for label, start, end in [
+        ('Tonight', today, today),
+        ('This weekend', friday, today + timedelta(days=6 - weekday)),
+        ('Next 7 days', today, today + timedelta(days=6)),
+    ]]
+
+#----------------------------------------------------------------------------#
+# Versioned edits.
+#----------------------------------------------------------------------------#
+
+def editable_fields(form):
+    return [field for field in form if field.name not in ('version', 'snapshot', 'csrf_token')]
+
+def snapshot_values(form):
+    return json.dumps({field.name: field.data for field in editable_fields(form)})
+
+def changed_values(form, snapshot):
+    try:
+        original = json.loads(snapshot)
+    except (TypeError, ValueError):
+        original = {}
+    return {field.name: field.data for field in editable_fields(form)
+        if field.name not in original or original[field.name] != field.data}
+
+def versioned_update(model, entity_id, version, values):
+    # one round trip: no SELECT first, only changed columns in the SET list,
+    # and no row back when someone else saved since the form was rendered
+    if 'name' in values:
+        # duplicate detection looks names up by their LSH buckets
+        values = dict(values, name_bands=dedup.name_bands(values['name']))
+    return db.session.execute(
+        db.update(model)
+        .where(model.id == entity_id, model.version == version)
+        .values(version=model.version + 1, updated_at=db.func.now(), **values)
+        .returning(model.version)
+    ).scalar()
+
+def edit_form_for(form_class, entity):
+    form = form_class(formdata=None, obj=entity, meta={'csrf':False})
+    form.snapshot.data = snapshot_values(form)
+    return form
+
+def edit_conflict(form, form_class, entity, template, **context):
+    # keep the user's input, rebase it on the current row and say what moved
+    current = edit_form_for(form_class, entity)
+    changed = changed_values(current, form.snapshot.data)
+    form.version.data = current.version.data
+    form.version.raw_data = None
+    form.snapshot.data = current.snapshot.data
+    flash('This was changed by someone else while you were editing'
+        + (' (' + ', '.join(changed) + ')' if changed else '')
+        + '. Review the form and submit again.')
+    return render_template(template, form=form, **context), 409
+
+#----------------------------------------------------------------------------#
+# Autocomplete index.
+#----------------------------------------------------------------------------#
+
+# per-worker, built once from the db and kept current by the write routes
+name_index = PrefixIndex()
+
+def index_names():
+    for venue in Venue.query.with_entities(Venue.id, Venue.name).yield_per(10000):
+        yield 'venue', venue.id, venue.name
+    for artist in Artist.query.with_entities(Artist.id, Artist.name).yield_per(10000):
+        yield 'artist', artist.id, artist.name
+
+def ensure_name_index():
+    return name_index.load_once(index_names)
+
+#----------------------------------------------------------------------------#
+# Catalog snapshot.
+#----------------------------------------------------------------------------#
+
+# per-worker copy of the venue/artist reference data used by the listing and
+# search pages, enabled with CATALOG_SNAPSHOT
+catalog = Catalog()
+
+def record_changes(kind, ids):
+    # part of the caller's transaction, so the change is visible exactly when the write is
+    if ids:
+        db.session.execute(CatalogChange.__table__.insert(), [{'kind': kind, 'entity_id': entity_id} for entity_id in ids])
+
+def catalog_rows(kind, ids=None):
+    model = Venue if kind == 'venue' else Artist
+    query = db.session.query(model.id, model.name, model.image_link, model.city, model.state,
+        model.genres, seeking_column(model))
+    if ids is not None:
+        query = query.filter(model.id.in_(ids))
+    for row in query.yield_per(10000):
+        yield (kind, *row)
+
+def catalog_checkpoint():
+    # changes are read again for CATALOG_CHANGE_MARGIN seconds, so a
+    # transaction that commits a little after it was stamped is not missed
+    now = db.session.execute(db.select(db.func.now())).scalar()
+    return now - timedelta(seconds=app.config['CATALOG_CHANGE_MARGIN'])
+
+def load_catalog():
+    return catalog_checkpoint(), itertools.chain(catalog_rows('venue'), catalog_rows('artist'))
+
+def catalog_changes_since(since):
+    checkpoint = catalog_checkpoint()
+    changed = {}
+    for kind, entity_id in db.session.query(CatalogChange.kind, CatalogChange.entity_id) \
+            .filter(CatalogChange.changed_at > since).distinct():
+        changed.setdefault(kind, set()).add(entity_id)
+    rows = [row for kind, ids in changed.items() for row in catalog_rows(kind, ids)]
+    return checkpoint, changed, rows
+
+def current_catalog():
+    if not app.config['CATALOG_SNAPSHOT']:
+        return None
+    catalog.load_once(load_catalog)
+    if catalog.refresh_due(app.config['CATALOG_REFRESH_INTERVAL']):
+        refreshed = catalog.refresh(catalog_changes_since)
+        if refreshed and name_index.loaded:
+            # the feed also carries other workers' edits to the autocomplete index
+            changed, rows = refreshed
+            for kind, ids in changed.items():
+                for entity_id in ids:
+                    record = catalog.get(kind, entity_id)
+                    if record is None:
+                        name_index.remove(kind, entity_id)
+                    else:
+                        name_index.add(kind, entity_id, record.name)
+    return catalog
+
+def resolve_shows(snapshot, shows):
+    # names and images from the snapshot; None if it is missing an entity
+    # so the caller falls back to the joined query
+    data = []
+    for show in shows:
+        artist = snapshot.get('artist', show.artist_id)
+        venue = snapshot.get('venue', show.venue_id)
+        if artist is None or venue is None:
+            return None
+        row = show_row(show)
+        row['artist_name'] = artist.name
+        row['artist_image_link'] = artist.image_link
+        row['venue_name'] = venue.name
+        data.append(row)
+    return data
+
+@app.cli.group('catalog')
+def catalog_cli():
+    """Catalog snapshot change feed."""
+
+@catalog_cli.command('prune')
+@click.option('--hours', default=24, show_default=True, help='Delete change records older than this.')
+def catalog_prune_command(hours):
+    deleted = CatalogChange.query.filter(
+        CatalogChange.changed_at < db.func.now() - timedelta(hours=hours)).delete(synchronize_session=False)
+    db.session.commit()
+    click.echo(f'Deleted {deleted} catalog changes')
+
+#----------------------------------------------------------------------------#
+# Admission control.
+#----------------------------------------------------------------------------#
+
+rate_limits_pruned_at = 0
+
+def take_shared_token(key, rate, burst):
+    # the same algorithm as ratelimit.Buckets, as one upsert that only
+    # updates (and so only returns a row) when the bucket has a token
+    global rate_limits_pruned_at
+    table = RateLimit.__table__
+    now = db.func.clock_timestamp()
+    interval = timedelta(seconds=1 / rate)
+    full_at = db.func.greatest(table.c.tat, now)
+    statement = pg_insert(table).values(key=key, tat=now + interval)
+    statement = statement.on_conflict_do_update(
+        index_elements=[table.c.key],
+        set_={'tat': full_at + interval},
+        where=full_at - now <= interval * (burst - 1),
+    ).returning(table.c.key)
+    try:
+        # on its own connection, so it neither waits for nor rolls back
+        # with the request's transaction
+        with db.engine.begin() as connection:
+            if connection.execute(statement).first() is not None:
+                if time.monotonic() - rate_limits_pruned_at > 60:
+                    rate_limits_pruned_at = time.monotonic()
+                    connection.execute(table.delete().where(table.c.tat < now))
+                return 0
+            wait = connection.execute(db.select(db.func.extract('epoch', table.c.tat - now))
+                .where(table.c.key == key)).scalar()
+            return max(float(wait or 0) - (burst - 1) / rate, 0.001)
+    except Exception as e:
+        # an unavailable backend lets requests through rather than failing them
+        print('Error checking rate limit: ',e)
+        return 0
+
+limiter = Limiter(app.config['RATE_LIMITS'], app.config['RATE_LIMIT_QUEUE_TIMEOUT'],
+    take=take_shared_token if app.config['RATE_LIMIT_BACKEND'] == 'postgres' else None)
+
+def limited(policy):
+    """Admit a view through the policy's client token bucket and worker gate.
+
+    Behind a reverse proxy, wrap app.wsgi_app in ProxyFix so remote_addr is
+    the client rather than the proxy.
+    """
+    def decorate(view):
+        @wraps(view)
+        def limited_view(*args, **kwargs):
+            wait = limiter.take(policy, request.remote_addr)
+            if wait:
+                raise TooManyRequests(retry_after=math.ceil(wait))
+            gate = limiter.gates[policy]
+            if not gate.enter():
+                raise TooManyRequests(retry_after=math.ceil(gate.timeout))
+            try:
+                return view(*args, **kwargs)
+            finally:
+                gate.leave()
+        return limited_view
+    return decorate
+
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
+@app.before_request
+def note_route():
+    # lets the compression stats group requests by route rather than by URL
+    request.environ[ROUTE_KEY] = request.url_rule.rule if request.url_rule else None
+
 @app.route('/')
 def index():
   return render_template('pages/home.html')
 
+@app.route('/sitemap.xml')
+def sitemap_index():
+    # written by build_sitemaps, served as files like the chunks it lists
+    # (or straight from SITEMAP_DIR by the web server in front)
+    return send_from_directory(app.config['SITEMAP_DIR'], sitemap.INDEX_NAME, mimetype='application/xml')
+
+@app.route('/sitemaps/<name>')
+def sitemap_chunk(name):
+    # only the chunks the current index lists; the manifest and half-written
+    # .partial files sit in the same directory
+    if name not in sitemap.load_manifest(app.config['SITEMAP_DIR']):
+        abort(404)
+    return send_from_directory(app.config['SITEMAP_DIR'], name, mimetype='application/gzip')
+
+@app.route('/autocomplete')
+def autocomplete():
+    # refreshing the snapshot also applies other workers' edits to the index
+    current_catalog()
+    kind = request.args.get('type')
+    limit = min(request.args.get('limit', 10, type=int), 50)
+    suggestions = ensure_name_index().lookup(request.args.get('q', ''), limit=limit,
+        kind=kind if kind in ('venue', 'artist') else None)
+    return jsonify(suggestions)
+
+@app.route('/autocomplete/stats')
+def autocomplete_stats():
+    stats = ensure_name_index().memory_usage()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/ratelimit/stats')
+def ratelimit_stats():
+    stats = limiter.stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/compression/stats')
+def compression_stats_view():
+    stats = {'routes': compression_stats.report()}
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/calendar/stats')
+def calendar_stats():
+    stats = calendar_feeds.stats()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
+@app.route('/catalog/stats')
+def catalog_stats():
+    snapshot = current_catalog()
+    if snapshot is None:
+        abort(404)
+    stats = snapshot.memory_usage()
+    stats['pid'] = os.getpid()
+    return jsonify(stats)
+
 
 #  Venues
 #  ----------------------------------------------------------------
@@ -109,36 +1617,39 @@ def venues():
   # NO POINT IN UPDATING NUMBER OF SHOWS BECAUSE NOTHING IS DONE WITH IT IN THE VIEW
     error = False
     try:
-        areas = Venue.query.with_entities(Venue.city, Venue.state).distinct()
+        filters = parse_filters(request.args)
+        snapshot = current_catalog()
+        if snapshot is not None:
+            venues = sorted(snapshot.select('venue', filters), key=lambda venue: (venue.state, venue.city, venue.name))
+            facets = snapshot.facets(venues, genre_values)
+        else:
+            query = apply_filters(Venue.query, Venue, filters)
+            venues = query.with_entities(Venue.id, Venue.name, Venue.city, Venue.state) \
+                .order_by(Venue.state, Venue.city, Venue.name).all()
+            facets = facet_counts(query, Venue)
         data = []
-        entry = []
-        for area in areas:
-            venue_data = []
-            venues = Venue.query.filter_by(state=area.state).filter_by(city=area.city)
-            for venue in venues:
-                venue_data.append({
-                    'id': venue.id,
-                    'name': venue.name
+        for venue in venues:
+            if not data or (data[-1]['city'], data[-1]['state']) != (venue.city, venue.state):
+                data.append({
+                    'city': venue.city,
+                    'state': venue.state,
+                    'venues': []
                 })
-            entry.append({
-                'city': area.city,
-                'state': area.state,
-                'venues' : venue_data
+            data[-1]['venues'].append({
+                'id': venue.id,
+                'name': venue.name
             })
-        data = entry
     except Exception as e:
         print('Error building venues: ',e)
-        for area in areas:
-            print(area)
         error = True
     finally:
         if error:
             abort(500)
         else:
-            print(data)
-            return render_template('pages/venues.html',areas=data)
+            return render_template('pages/venues.html', areas=data, facets=facets, filters=filters)
 
 @app.route('/venues/search', methods=['POST'])
+@limited('search')
 def search_venues():
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
@@ -147,7 +1658,15 @@ def search_venues():
     try:
         data = []
         search_term = request.form.get('search_term', '')
-        venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
+        filters = parse_filters(request.values)
+        snapshot = current_catalog()
+        if snapshot is not None:
+            venues = sorted(snapshot.select('venue', filters, search_term), key=lambda venue: venue.id)
+            facets = snapshot.facets(venues, genre_values)
+        else:
+            query = apply_filters(Venue.query.filter(Venue.name.ilike('%' + search_term + '%')), Venue, filters)
+            venues = query.with_entities(Venue.id, Venue.name).order_by(Venue.id).all()
+            facets = facet_counts(query, Venue)
         count = len(venues)
         for venue in venues:
             data.append({
@@ -165,7 +1684,8 @@ def search_venues():
         if error:
             abort(500)
         else:
-            return render_template('pages/search_venues.html', results=response, search_term=search_term)
+            return render_template('pages/search_venues.html', results=response, search_term=search_term,
+                facets=facets, filters=filters)
 
 @app.route('/venues/<int:venue_id>')
 def show_venue(venue_id):
@@ -174,30 +1694,18 @@ def show_venue(venue_id):
     try:
         venue = Venue.query.get(venue_id)
         data = ''
-        upcomingShows = 0
-        pastShows = 0
-        upcoming_shows = []
-        past_shows = []
-        shows = Shows.query.filter_by(venue_id=venue.id).all()
-        for show in shows:
-            if show.start_time > datetime.now():
-                upcomingShows += 1
-                artist_info = Artist.query.get(show.artist_id)
-                upcoming_shows.append({
-                    'artist_id' : artist_info.id,
-                    'artist_name' : artist_info.name,
-                    'artist_image_link' : artist_info.image_link,
-                    'start_time' : show.start_time.strftime("%m/%d/%Y, %H:%M")
-                })
-            else:
-                pastShows += 1
-                artist_info = Artist.query.get(show.artist_id)
-                past_shows.append({
-                    'artist_id' : artist_info.id,
-                    'artist_name' : artist_info.name,
-                    'artist_image_link' : artist_info.image_link,
-                    'start_time' : show.start_time.strftime("%m/%d/%Y, %H:%M")
-                })
+        now = datetime.now()
+        shows = db.session.query(
+            Shows.start_time,
+            Shows.series_id,
+            Artist.id.label('artist_id'),
+            Artist.name.label('artist_name'),
+            Artist.image_link.label('artist_image_link')
+        ).join(Artist, Artist.id == Shows.artist_id).filter(Shows.venue_id == venue.id)
+        upcoming_shows = [show_row(show) for show in in_period(shows, 'upcoming', now)]
+        past_shows = [show_row(show) for show in in_period(shows, 'past', now)]
+        upcomingShows = len(upcoming_shows)
+        pastShows = len(past_shows)
         data = {
             'id': venue.id,
             'name': venue.name,
@@ -227,6 +1735,10 @@ def show_venue(venue_id):
             print(data)
         return render_template('pages/show_venue.html', venue=data)
 
+@app.route('/venues/<int:venue_id>/calendar.ics')
+def venue_calendar(venue_id):
+    return calendar_response(Venue, venue_id)
+
 #  Create Venue
 #  ----------------------------------------------------------------
 
@@ -236,16 +1748,26 @@ def create_venue_form():
   return render_template('forms/new_venue.html', form=form)
 
 @app.route('/venues/create', methods=['POST'])
+@limited('write')
 def create_venue_submission():
     form = VenueForm(request.form, meta={'csrf':False})
     if form.validate():
         try:
             venue = Venue()
             form.populate_obj(venue)
+            venue.name_bands = dedup.name_bands(venue.name)
             db.session.add(venue)
+            db.session.flush()
+            duplicates = likely_duplicates(Venue, venue)
+            save_duplicates('venue', [(score, min(venue.id, other.id), max(venue.id, other.id))
+                for score, other in duplicates])
+            record_changes('venue', [venue.id])
             db.session.commit()
+            name_index.add('venue', venue.id, venue.name)
+            catalog.expire()
             # on successful db insert, flash success
             flash('Venue ' + request.form['name'] + ' was successfully listed!')
+            flash_duplicates('Venue', duplicates)
         except ValueError as e:
             print(e)
             # e.g., flash('An error occurred. Venue ' + data.name + ' could not be listed.')
@@ -262,16 +1784,37 @@ def create_venue_submission():
 
     return render_template('pages/home.html')
 
-@app.route('/venues/<venue_id>', methods=['POST'])
+@app.route('/venues/<int:venue_id>', methods=['POST'])
+@limited('write')
 def delete_venue(venue_id):
-    error = False
+    return delete_venues_submission([venue_id])
+
+@app.route('/venues/bulk-delete', methods=['POST'])
+@limited('write')
+def bulk_delete_venues():
+    return delete_venues_submission(request.form.getlist('venue_id', type=int))
+
+def delete_venues_submission(venue_ids):
     try:
-        venue = Venue.query.get(venue_id)
-        db.session.delete(venue)
+        # the venue rows first, then the artists' feeds, the order
+        # touch_related_schedules and show writes take them in
+        db.session.execute(db.select(Venue.id).where(Venue.id.in_(venue_ids)).with_for_update())
+        touch_schedules(Artist, counterpart_ids(Venue, venue_ids))
+        deleted = delete_entities(Venue, venue_ids)
+        record_changes('venue', [venue_id for venue_id, name in deleted])
         db.session.commit()
-        flash('Venue ' + venue.name + ' was successfully deleted!')
-    except ValueError as e:
-        flash('Unable to delete Venue ' + venue.name + '!')
+        catalog.expire()
+        for venue_id, name in deleted:
+            name_index.remove('venue', venue_id)
+        if len(deleted) == 1:
+            flash('Venue ' + deleted[0].name + ' was successfully deleted!')
+        elif deleted:
+            flash(str(len(deleted)) + ' Venues were successfully deleted!')
+        else:
+            flash('No matching Venues to delete!')
+    except Exception as e:
+        print(e)
+        flash('Unable to delete Venues!')
         db.session.rollback()
     finally:
         db.session.close()
@@ -282,11 +1825,20 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 @app.route('/artists')
 def artists():
-    artists = Artist.query.all()
+    filters = parse_filters(request.args)
+    snapshot = current_catalog()
+    if snapshot is not None:
+        artists = sorted(snapshot.select('artist', filters), key=lambda artist: artist.id)
+        facets = snapshot.facets(artists, genre_values)
+    else:
+        query = apply_filters(Artist.query, Artist, filters)
+        artists = query.with_entities(Artist.id, Artist.name).order_by(Artist.id).all()
+        facets = facet_counts(query, Artist)
     return render_template('pages/artists.html',
-    artists=artists)
+    artists=artists, facets=facets, filters=filters)
 
 @app.route('/artists/search', methods=['POST'])
+@limited('search')
 def search_artists():
     # seach for "A" should return "Guns N Petals", "Matt Quevado", and "The Wild Sax Band".
     # search for "band" should return "The Wild Sax Band".
@@ -295,7 +1847,15 @@ def search_artists():
     try:
         data = []
         search_term = request.form.get('search_term', '')
-        artists = Artist.query.filter(Artist.name.ilike('%' + search_term + '%')).all()
+        filters = parse_filters(request.values)
+        snapshot = current_catalog()
+        if snapshot is not None:
+            artists = sorted(snapshot.select('artist', filters, search_term), key=lambda artist: artist.id)
+            facets = snapshot.facets(artists, genre_values)
+        else:
+            query = apply_filters(Artist.query.filter(Artist.name.ilike('%' + search_term + '%')), Artist, filters)
+            artists = query.with_entities(Artist.id, Artist.name).order_by(Artist.id).all()
+            facets = facet_counts(query, Artist)
         count = len(artists)
         for artist in artists:
             data.append({
@@ -313,7 +1873,8 @@ def search_artists():
         if error:
             abort(500)
         else:
-            return render_template('pages/search_artists.html', results=response, search_term=search_term)
+            return render_template('pages/search_artists.html', results=response, search_term=search_term,
+                facets=facets, filters=filters)
 
 @app.route('/artists/<int:artist_id>')
 def show_artist(artist_id):
@@ -322,29 +1883,18 @@ def show_artist(artist_id):
     try:
         artist = Artist.query.get(artist_id)
         data = ''
-        upcomingShows = 0
-        pastShows = 0
-        upcoming_shows = []
-        past_shows = []
-        shows = Shows.query.filter_by(artist_id=artist.id).all()
-        for show in shows:
-            venue_info = Venue.query.get(show.venue_id)
-            if show.start_time > datetime.now():
-                upcomingShows += 1
-                upcoming_shows.append({
-                    'venue_image_link' : venue_info.image_link,
-                    'venue_id' : venue_info.id,
-                    'venue_name' : venue_info.name,
-                    'start_time' : show.start_time.strftime("%m/%d/%Y, %H:%M")
-                })
-            else:
-                pastShows += 1
-                past_shows.append({
-                    'venue_image_link' : venue_info.image_link,
-                    'venue_id' : venue_info.id,
-                    'venue_name' : venue_info.name,
-                    'start_time' : show.start_time.strftime("%m/%d/%Y, %H:%M")
-                })
+        now = datetime.now()
+        shows = db.session.query(
+            Shows.start_time,
+            Shows.series_id,
+            Venue.id.label('venue_id'),
+            Venue.name.label('venue_name'),
+            Venue.image_link.label('venue_image_link')
+        ).join(Venue, Venue.id == Shows.venue_id).filter(Shows.artist_id == artist.id)
+        upcoming_shows = [show_row(show) for show in in_period(shows, 'upcoming', now)]
+        past_shows = [show_row(show) for show in in_period(shows, 'past', now)]
+        upcomingShows = len(upcoming_shows)
+        pastShows = len(past_shows)
         data = {
             'id': artist.id,
             'name': artist.name,
@@ -372,6 +1922,10 @@ def show_artist(artist_id):
             print(data)
             return render_template('pages/show_artist.html', artist=data)
 
+@app.route('/artists/<int:artist_id>/calendar.ics')
+def artist_calendar(artist_id):
+    return calendar_response(Artist, artist_id)
+
 #  Update
 #  ----------------------------------------------------------------
 @app.route('/artists/<int:artist_id>/edit', methods=['GET'])
@@ -380,7 +1934,7 @@ def edit_artist(artist_id):
     error = False
     try:
         artist = Artist.query.get(artist_id)
-        form = ArtistForm(obj=artist)
+        form = edit_form_for(EditArtistForm, artist)
     except Exception as e:
         print('Error populating artist form: ',e)
         error = True
@@ -392,14 +1946,25 @@ def edit_artist(artist_id):
             return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 @app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@limited('write')
 def edit_artist_submission(artist_id):
     # called upon submitting the new artist listing form
-    form = ArtistForm(request.form, meta={'csrf':False})
+    form = EditArtistForm(request.form, meta={'csrf':False})
     if form.validate():
       try:
-          artist = Artist.query.get(artist_id)
-          form.populate_obj(artist)
+          changes = changed_values(form, form.snapshot.data)
+          if changes and versioned_update(Artist, artist_id, form.version.data, changes) is None:
+              db.session.rollback()
+              artist = Artist.query.get_or_404(artist_id)
+              return edit_conflict(form, EditArtistForm, artist, 'forms/edit_artist.html', artist=artist)
+          if changes:
+              record_changes('artist', [artist_id])
+          if calendar_fields & changes.keys():
+              touch_related_schedules(Artist, [artist_id])
           db.session.commit()
+          catalog.expire()
+          if 'name' in changes:
+              name_index.add('artist', artist_id, changes['name'])
           # on successful db insert, flash success
           flash('Artist ' + request.form['name'] + ' was successfully changed!')
       except ValueError as e:
@@ -417,16 +1982,34 @@ def edit_artist_submission(artist_id):
 
     return redirect(url_for('show_artist', artist_id=artist_id))
 
-@app.route('/artists/<artist_id>', methods=['POST'])
+@app.route('/artists/<int:artist_id>', methods=['POST'])
+@limited('write')
 def delete_artist(artist_id):
-    error = False
+    return delete_artists_submission([artist_id])
+
+@app.route('/artists/bulk-delete', methods=['POST'])
+@limited('write')
+def bulk_delete_artists():
+    return delete_artists_submission(request.form.getlist('artist_id', type=int))
+
+def delete_artists_submission(artist_ids):
     try:
-        artist = Artist.query.get(artist_id)
-        db.session.delete(artist)
+        touch_schedules(Venue, counterpart_ids(Artist, artist_ids))
+        deleted = delete_entities(Artist, artist_ids)
+        record_changes('artist', [artist_id for artist_id, name in deleted])
         db.session.commit()
-        flash('Artist ' + artist.name + ' was successfully deleted!')
-    except ValueError as e:
-        flash('Unable to delete Artist ' + artist.name + '!')
+        catalog.expire()
+        for artist_id, name in deleted:
+            name_index.remove('artist', artist_id)
+        if len(deleted) == 1:
+            flash('Artist ' + deleted[0].name + ' was successfully deleted!')
+        elif deleted:
+            flash(str(len(deleted)) + ' Artists were successfully deleted!')
+        else:
+            flash('No matching Artists to delete!')
+    except Exception as e:
+        print(e)
+        flash('Unable to delete Artists!')
         db.session.rollback()
     finally:
         db.session.close()
@@ -438,7 +2021,7 @@ def edit_venue(venue_id):
     error = False
     try:
         venue = Venue.query.get(venue_id)
-        form = VenueForm(obj=venue)
+        form = edit_form_for(EditVenueForm, venue)
     except Exception as e:
         print('Error populating venue form: ',e)
         error = True
@@ -450,14 +2033,25 @@ def edit_venue(venue_id):
             return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 @app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@limited('write')
 def edit_venue_submission(venue_id):
     # venue record with ID <venue_id> using the new attributes
-    form = VenueForm(request.form, meta={'csrf':False})
+    form = EditVenueForm(request.form, meta={'csrf':False})
     if form.validate():
       try:
-          venue = Venue.query.get(venue_id)
-          form.populate_obj(venue)
+          changes = changed_values(form, form.snapshot.data)
+          if changes and versioned_update(Venue, venue_id, form.version.data, changes) is None:
+              db.session.rollback()
+              venue = Venue.query.get_or_404(venue_id)
+              return edit_conflict(form, EditVenueForm, venue, 'forms/edit_venue.html', venue=venue)
+          if changes:
+              record_changes('venue', [venue_id])
+          if calendar_fields & changes.keys():
+              touch_related_schedules(Venue, [venue_id])
           db.session.commit()
+          catalog.expire()
+          if 'name' in changes:
+              name_index.add('venue', venue_id, changes['name'])
           # on successful db insert, flash success
           flash('Venue ' + request.form['name'] + ' was successfully changed!')
       except ValueError as e:
@@ -484,6 +2078,7 @@ def create_artist_form():
   return render_template('forms/new_artist.html', form=form)
 
 @app.route('/artists/create', methods=['POST'])
+@limited('write')
 def create_artist_submission():
   # called upon submitting the new artist listing form
   form = ArtistForm(request.form, meta={'csrf':False})
@@ -491,10 +2086,19 @@ def create_artist_submission():
       try:
           artist = Artist()
           form.populate_obj(artist)
+          artist.name_bands = dedup.name_bands(artist.name)
           db.session.add(artist)
+          db.session.flush()
+          duplicates = likely_duplicates(Artist, artist)
+          save_duplicates('artist', [(score, min(artist.id, other.id), max(artist.id, other.id))
+              for score, other in duplicates])
+          record_changes('artist', [artist.id])
           db.session.commit()
+          name_index.add('artist', artist.id, artist.name)
+          catalog.expire()
           # on successful db insert, flash success
           flash('Artist ' + request.form['name'] + ' was successfully listed!')
+          flash_duplicates('Artist', duplicates)
       except ValueError as e:
           print(e)
           # e.g., flash('An error occurred. Artist ' + data.name + ' could not be listed.')
@@ -518,33 +2122,45 @@ def create_artist_submission():
 def shows():
   # displays list of shows at /shows
   #NO POINT IN GETTING THE NUMBER OF SHOWS BECUASE NOTHING IS DONE WITH IT IN THE VIEW
+    if any(name in request.args for name in browse_args):
+        return whats_on()
     error = False
     try:
-        shows = Shows.query.all()
-        data = []
-        for show in shows:
-            venues = Venue.query.get(show.venue_id)
-            artist = Artist.query.get(show.artist_id)
-            data.append({
-                'show_id': show.id,
-                'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M"),
-                'artist_id' : show.artist_id,
-                'artist_name' : artist.name,
-                'artist_image_link' : artist.image_link,
-                'venue_id' : show.venue_id,
-                'venue_name' : venues.name
-            })
+        period = 'past' if request.args.get('when') == 'past' else 'upcoming'
+        now = datetime.now()
+        data = None
+        snapshot = current_catalog()
+        if snapshot is not None:
+            data = resolve_shows(snapshot, in_period(db.session.query(
+                Shows.id.label('show_id'),
+                Shows.start_time,
+                Shows.series_id,
+                Shows.artist_id,
+                Shows.venue_id
+            ), period, now))
+        if data is None:
+            data = [show_row(show) for show in in_period(shows_query(), period, now)]
     except Exception as e:
         print('Error building shows: ',e)
-        print(data)
         error = True
     finally:
         if error:
             abort(500)
         else:
-            print(data)
-            return render_template('pages/shows.html', shows=data)
+            return render_template('pages/shows.html', shows=data, period=period)
+
 
+def whats_on():
+    # /shows?from=&to=&city=&state=&genre=&month=: shows in a date range by
+    # day, under a month calendar of daily show counts
+    filters = browse_filters(request.args)
+    month = month_of(clamp_day(parse_day((request.args.get('month') or '') + '-01') or filters['from']))
+    days, truncated = browse_shows(filters)
+    return render_template('pages/whats_on.html', filters=filters, days=days, truncated=truncated,
+        limit=app.config['SHOWS_BROWSE_LIMIT'], month=month, weeks=month_calendar(month, filters),
+        previous_url=browse_url(filters, filters['from'], filters['to'], add_months(month, -1)),
+        next_url=browse_url(filters, filters['from'], filters['to'], add_months(month, 1)),
+        presets=browse_presets(filters, date.today()), states=state_values, genres=genre_values)
 
 @app.route('/shows/create')
 def create_shows():
@@ -553,22 +2169,72 @@ def create_shows():
   return render_template('forms/new_show.html', form=form)
 
 @app.route('/shows/create', methods=['POST'])
+@limited('write')
 def create_show_submission():
   # called to create new shows in the db, upon submitting new show listing form
  form = ShowForm(request.form, meta={'csrf':False})
  if form.validate():
      try:
-         show = Shows()
-         form.populate_obj(show)
-         db.session.add(show)
+         venue_id = int(form.venue_id.data)
+         artist_id = int(form.artist_id.data)
+         start_time = form.start_time.data
+         if form.repeat.data:
+             rule = recurrence.build_rule(form.repeat.data, start_time, form.interval.data,
+                 form.until.data, form.count.data, form.weekdays.data)
+             start_times = recurrence.occurrences(rule, app.config['SHOW_SERIES_MAX_SHOWS'])
+             if start_times is None:
+                 flash('A series can have at most ' + str(app.config['SHOW_SERIES_MAX_SHOWS']) + ' shows!')
+                 return render_template('forms/new_show.html', form=form)
+             if not start_times:
+                 flash('The series has no shows before its end date!')
+                 return render_template('forms/new_show.html', form=form)
+         else:
+             start_times = [start_time]
+         problems = partition_problems(start_times)
+         if not problems:
+             ensure_show_partitions(start_times)
+             # every date checked against the venue and artist in one query
+             problems = schedule_problems(venue_id, artist_id, start_times)
+         if problems:
+             for problem in problems[:5]:
+                 flash(problem)
+             if len(problems) > 5:
+                 flash('... and ' + str(len(problems) - 5) + ' more')
+             return render_template('forms/new_show.html', form=form)
+         if form.repeat.data:
+             series = ShowSeries(venue_id=venue_id, artist_id=artist_id, first_start_time=start_time,
+                 rule=recurrence.rule_text(rule))
+             db.session.add(series)
+             db.session.flush()
+             insert_shows(venue_id, artist_id, start_times, series.id)
+             # counted in this transaction rather than by show_listed jobs,
+             # so editing the series straight away adjusts counts that
+             # already include it
+             add_to_rollups(analytics.count_rollups(series_shows(rollup_source(), series.id).all()))
+             events = [show_event(row) for row in
+                 series_shows(show_event_query(), series.id).order_by(Shows.start_time)]
+         else:
+             (show_id, show_start), = insert_shows(venue_id, artist_id, start_times)
+             # follow-up work runs on a worker, the job commits with the show;
+             # under the rollup lock, so a recount sees either both or neither
+             lock_rollups()
+             enqueue('show_listed', show_id=show_id, start_time=show_start.isoformat())
+             events = [show_event(show_event_query().filter(Shows.id == show_id, Shows.start_time == show_start).one())]
+         touch_schedules(Venue, [venue_id])
+         touch_schedules(Artist, [artist_id])
+         for event in events:
+             queue_show_event(event)
          db.session.commit()
+         for event in events:
+             publish_show_event(event)
          # on successful db insert, flash success
-         flash('Show was successfully listed!')
-     except ValueError as e:
+         if len(start_times) > 1:
+             flash(str(len(start_times)) + ' shows were successfully listed!')
+         else:
+             flash('Show was successfully listed!')
+     except Exception as e:
          print(e)
-          # e.g., flash('An error occurred. Show could not be listed.')
-          # see: http://flask.pocoo.org/docs/1.0/patterns/flashing/
-         flash('Unable to list Show for date' + request.form['show_date'] + '!')
+         flash('An error occurred. Show could not be listed.')
          db.session.rollback()
      finally:
          db.session.close()
@@ -580,31 +2246,154 @@ def create_show_submission():
 
  return render_template('pages/home.html')
 
+#  Show series
+#  ----------------------------------------------------------------
+
+@app.route('/series/<int:series_id>/edit', methods=['GET'])
+def edit_series(series_id):
+    series = ShowSeries.query.get_or_404(series_id)
+    now = datetime.now()
+    shows = [show_row(show) for show in in_period(series_shows(shows_query(), series_id), 'upcoming', now)]
+    form = SeriesForm(artist_id=series.artist_id, venue_id=series.venue_id,
+        time=(shows[0]['start_time'] if shows else series.first_start_time).time())
+    return render_template('forms/edit_series.html', form=form, series=series, shows=shows)
+
+@app.route('/series/<int:series_id>/edit', methods=['POST'])
+@limited('write')
+def edit_series_submission(series_id):
+    # moves every upcoming show of the series with one UPDATE; past shows
+    # stay as they were
+    series = ShowSeries.query.get_or_404(series_id)
+    form = SeriesForm(request.form, meta={'csrf':False})
+    if not form.validate():
+        for field, err in form.errors.items():
+            flash(field + ' ' + '|'.join(err))
+        return redirect(url_for('edit_series', series_id=series_id))
+    try:
+        venue_id = int(form.venue_id.data)
+        artist_id = int(form.artist_id.data)
+        now = datetime.now()
+        start_times = [datetime.combine(start_time.date(), form.time.data) for (start_time,) in
+            in_period(series_shows(db.session.query(Shows.start_time), series_id), 'upcoming', now)]
+        problems = schedule_problems(venue_id, artist_id, start_times, series_id) if start_times else []
+        if problems:
+            for problem in problems[:5]:
+                flash(problem)
+            return redirect(url_for('edit_series', series_id=series_id))
+        before = upcoming_series_rollups(series_id, now)
+        # the time of day changes but never the date, so no show moves to
+        # another partition
+        updated = db.session.execute(Shows.__table__.update()
+            .where(Shows.series_id == series_id, Shows.start_time > now)
+            .values(venue_id=venue_id, artist_id=artist_id,
+                start_time=db.func.date_trunc('day', Shows.start_time) + form.time.data)).rowcount
+        adjust_rollups(before, upcoming_series_rollups(series_id, now))
+        touch_schedules(Venue, [series.venue_id, venue_id])
+        touch_schedules(Artist, [series.artist_id, artist_id])
+        series.venue_id = venue_id
+        series.artist_id = artist_id
+        series.first_start_time = datetime.combine(series.first_start_time.date(), form.time.data)
+        db.session.commit()
+        flash(str(updated) + ' upcoming shows were successfully updated!')
+    except Exception as e:
+        print(e)
+        flash('An error occurred. The series could not be updated.')
+        db.session.rollback()
+    finally:
+        db.session.close()
+    return redirect(url_for('edit_series', series_id=series_id))
+
+@app.route('/series/<int:series_id>/cancel', methods=['POST'])
+@limited('write')
+def cancel_series(series_id):
+    # deletes the upcoming shows with one statement and keeps past ones
+    try:
+        now = datetime.now()
+        before = upcoming_series_rollups(series_id, now)
+        cancelled = db.session.execute(Shows.__table__.delete()
+            .where(Shows.series_id == series_id, Shows.start_time > now)).rowcount
+        adjust_rollups(before, {})
+        touch_schedules(Venue, db.select(ShowSeries.venue_id).where(ShowSeries.id == series_id))
+        touch_schedules(Artist, db.select(ShowSeries.artist_id).where(ShowSeries.id == series_id))
+        db.session.commit()
+        flash(str(cancelled) + ' upcoming shows were successfully cancelled!')
+    except Exception as e:
+        print(e)
+        flash('An error occurred. The series could not be cancelled.')
+        db.session.rollback()
+    finally:
+        db.session.close()
+    return render_template('pages/home.html')
+
+@app.route('/shows/stream')
+def show_stream():
+    # server-sent events for newly listed shows, optionally narrowed with
+    # ?venue_id=&artist_id=&city=&state=; reconnecting clients send
+    # Last-Event-ID (the last show id they saw) and get what they missed
+    ensure_show_listener()
+    filters = show_event_filters(request.args)
+    last_event_id = request.headers.get('Last-Event-ID', request.args.get('last_event_id', ''))
+    # cursor first, so a show committed while the catch-up query runs is
+    # delivered by the broker instead of falling in between
+    cursor = show_broker.cursor()
+    missed = []
+    if last_event_id.isdigit():
+        query = filter_show_query(show_event_query().filter(Shows.id > int(last_event_id)), filters)
+        missed = [show_event(row) for row in query.order_by(Shows.id).limit(app.config['SHOW_EVENTS_RESUME_LIMIT'])]
+    # an idle subscriber must not hold a pooled connection
+    db.session.remove()
+    heartbeat = app.config['SHOW_EVENTS_HEARTBEAT']
+
+    def stream(position):
+        yield 'retry: 5000\n\n'
+        sent = set()
+        for event in missed:
+            sent.add(event['id'])
+            yield format_show_event(event)
+        while True:
+            position, events = show_broker.wait(position, timeout=heartbeat)
+            if not events:
+                yield ': keepalive\n\n'
+            for event in events:
+                if event['id'] not in sent and event_matches(event, filters):
+                    yield format_show_event(event)
+
+    return Response(stream(cursor), mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/shows/search', methods=['POST'])
+@limited('search')
 def search_shows():
     # seach for Hop should return "The Musical Hop".
     # search for "Music" should return "The Musical Hop" and "Park Square Live Music & Coffee"
     error = False
     try:
-        show_data = []
-        data = []
         search_term = request.form.get('search_term', '')
-        venues = Venue.query.filter(Venue.name.ilike('%' + search_term + '%')).all()
-        count = 0
-        for venue in venues:
-            shows = Shows.query.filter_by(venue_id=venue.id).all()
-            count += len(shows)
-            for show in shows:
-                artist = Artist.query.get(show.artist_id)
-                show_data.append({
-                    'show_id': show.id,
-                    'start_time': show.start_time.strftime("%m/%d/%Y, %H:%M"),
-                    'artist_id' : artist.id,
-                    'artist_name' : artist.name,
-                    'artist_image_link' : artist.image_link,
-                    'venue_id' : venue.id,
-                    'venue_name' : venue.name
-                })
+        filters = parse_filters(request.values)
+        show_data = None
+        snapshot = current_catalog()
+        if snapshot is not None:
+            venues = snapshot.select('venue', filters, search_term)
+            facets = snapshot.facets(venues, genre_values)
+            if venues:
+                show_data = resolve_shows(snapshot, db.session.query(
+                    Shows.id.label('show_id'),
+                    Shows.start_time,
+                    Shows.series_id,
+                    Shows.artist_id,
+                    Shows.venue_id
+                ).filter(Shows.venue_id.in_([venue.id for venue in venues])).order_by(Shows.venue_id, Shows.start_time))
+            else:
+                show_data = []
+        if show_data is None:
+            query = apply_filters(Venue.query.filter(Venue.name.ilike('%' + search_term + '%')), Venue, filters)
+            matching = query.with_entities(Venue.id).subquery()
+            show_data = [show_row(show) for show in shows_query()
+                .filter(Shows.venue_id.in_(db.select(matching.c.id)))
+                .order_by(Shows.venue_id, Shows.start_time)]
+            if snapshot is None:
+                facets = facet_counts(query, Venue)
+        count = len(show_data)
         response = {
             'count': count,
             'data': show_data,
@@ -616,13 +2405,137 @@ def search_shows():
         if error:
             abort(500)
         else:
-            print(response)
-            return render_template('pages/search_shows.html', results=response, search_term=search_term)
+            return render_template('pages/search_shows.html', results=response, search_term=search_term,
+                facets=facets, filters=filters)
+
+#  Duplicates
+#  ----------------------------------------------------------------
+
+@app.route('/duplicates')
+def duplicates():
+    kind = request.args.get('kind', 'venue')
+    if kind not in ('venue', 'artist'):
+        abort(400)
+    model = Venue if kind == 'venue' else Artist
+    entity = db.aliased(model)
+    duplicate = db.aliased(model)
+    # pairs whose entities still both exist, most alike first
+    pairs = db.session.query(DuplicateCandidate.id, DuplicateCandidate.score,
+        entity.id.label('entity_id'), entity.name.label('entity_name'), entity.city,
+        duplicate.id.label('duplicate_id'), duplicate.name.label('duplicate_name'), duplicate.city.label('duplicate_city')) \
+        .join(entity, entity.id == DuplicateCandidate.entity_id) \
+        .join(duplicate, duplicate.id == DuplicateCandidate.duplicate_id) \
+        .filter(DuplicateCandidate.kind == kind, DuplicateCandidate.dismissed.is_(False)) \
+        .order_by(DuplicateCandidate.score.desc(), DuplicateCandidate.id).limit(200).all()
+    return render_template('pages/duplicates.html', kind=kind, pairs=pairs)
+
+@app.route('/duplicates/<int:candidate_id>/merge', methods=['POST'])
+@limited('write')
+def merge_duplicate(candidate_id):
+    # keep is the id of the one that stays, the other is merged into it
+    candidate = DuplicateCandidate.query.get_or_404(candidate_id)
+    kind = candidate.kind
+    keep = request.form.get('keep', type=int)
+    if keep not in (candidate.entity_id, candidate.duplicate_id):
+        abort(400)
+    duplicate_id = candidate.duplicate_id if keep == candidate.entity_id else candidate.entity_id
+    try:
+        moved = merge_entities(Venue if kind == 'venue' else Artist, duplicate_id, keep)
+        db.session.commit()
+        catalog.expire()
+        name_index.remove(kind, duplicate_id)
+        flash('Merged ' + kind + ' ' + str(duplicate_id) + ' into ' + str(keep) + ', ' + str(moved) + ' shows moved!')
+    except Exception as e:
+        print(e)
+        flash('Unable to merge the duplicates!')
+        db.session.rollback()
+    finally:
+        db.session.close()
+    return redirect(url_for('duplicates', kind=kind))
+
+@app.route('/duplicates/<int:candidate_id>/dismiss', methods=['POST'])
+@limited('write')
+def dismiss_duplicate(candidate_id):
+    candidate = DuplicateCandidate.query.get_or_404(candidate_id)
+    kind = candidate.kind
+    candidate.dismissed = True
+    db.session.commit()
+    return redirect(url_for('duplicates', kind=kind))
+
+#  Stats
+#  ----------------------------------------------------------------
+
+def stats_window(args):
+    months = min(max(args.get('months', 12, type=int), 1), 120)
+    end = add_months(month_of(datetime.now()), 1)
+    return add_months(end, -months), end
+
+def entity_names(model, totals):
+    ids = [int(key) for key, shows in totals]
+    return dict(db.session.query(model.id, model.name).filter(model.id.in_(ids)).all()) if ids else {}
+
+@app.route('/stats')
+def stats():
+    # everything here comes from the show_rollups table, never from shows
+    start, end = stats_window(request.args)
+    genres = rollup_totals('genre', 'month', start, end)
+    genre_months = {}
+    for bucket, dimension, key, count in db.session.query(ShowRollup.bucket, ShowRollup.dimension,
+            ShowRollup.key, ShowRollup.show_count).filter(ShowRollup.period == 'month',
+            ShowRollup.dimension == 'genre', ShowRollup.bucket >= start, ShowRollup.bucket < end):
+        genre_months[(key, bucket)] = count
+    venues = rollup_totals('venue', 'month', start, end, limit=10)
+    artists = rollup_totals('artist', 'month', start, end, limit=10)
+    venue_names = entity_names(Venue, venues)
+    artist_names = entity_names(Artist, artists)
+    months = [add_months(start, offset) for offset in range((end.year - start.year) * 12 + end.month - start.month)]
+    return render_template('pages/stats.html',
+        months=months,
+        monthly=dict(rollup_series('all', '', 'month', start, end)),
+        genres=genres,
+        genre_months=genre_months,
+        cities=rollup_totals('city', 'month', start, end, limit=10),
+        venues=[(int(key), venue_names.get(int(key), 'Deleted venue'), shows) for key, shows in venues],
+        artists=[(int(key), artist_names.get(int(key), 'Deleted artist'), shows) for key, shows in artists])
+
+@app.route('/stats.json')
+def stats_json():
+    # /stats.json?dimension=genre&period=month&from=2021-01-01&to=2022-01-01&limit=10
+    dimension = request.args.get('dimension', 'all')
+    period = request.args.get('period', 'month')
+    if dimension not in analytics.DIMENSIONS or period not in analytics.PERIODS:
+        abort(400)
+    default_start, default_end = stats_window(request.args)
+    try:
+        start = date.fromisoformat(request.args['from']) if 'from' in request.args else default_start
+        end = date.fromisoformat(request.args['to']) if 'to' in request.args else default_end
+    except ValueError:
+        abort(400)
+    totals = rollup_totals(dimension, period, start, end, limit=request.args.get('limit', type=int))
+    keys = {key for key, shows in totals}
+    series = {}
+    for bucket, key, count in db.session.query(ShowRollup.bucket, ShowRollup.key, ShowRollup.show_count) \
+            .filter(ShowRollup.period == period, ShowRollup.dimension == dimension,
+                ShowRollup.bucket >= start, ShowRollup.bucket < end).order_by(ShowRollup.bucket):
+        if key in keys:
+            series.setdefault(key, []).append([bucket.isoformat(), count])
+    return jsonify({
+        'dimension': dimension,
+        'period': period,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'totals': [{'key': key, 'shows': int(shows)} for key, shows in totals],
+        'series': series,
+    })
 
 @app.errorhandler(404)
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
+@app.errorhandler(429)
+def too_many_requests_error(error):
+    return render_template('errors/429.html'), 429, {'Retry-After': str(error.retry_after or 1)}
+
 @app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
@@ -642,8 +2555,28 @@ if not app.debug:
 # Launch.
 #----------------------------------------------------------------------------#
 
+def warm_up():
+    """Build what a worker would otherwise build on its first requests.
+
+    gunicorn runs this once in the master (see gunicorn.conf.py), so the
+    workers forked from it share the compiled templates, forms and
+    in-memory indexes copy-on-write instead of each building its own.
+    """
+    for name in app.jinja_env.list_templates(extensions=['html']):
+        app.jinja_env.get_template(name)
+    with app.test_request_context():
+        for form_class in (ShowForm, VenueForm, ArtistForm, EditVenueForm, EditArtistForm):
+            form_class(meta={'csrf': False})
+    with app.app_context():
+        ensure_name_index()
+        current_catalog()
+        db.session.remove()
+        # connections opened while loading must not be shared with forked workers
+        db.engine.dispose()
+
 # Default port:
 if __name__ == '__main__':
+    warm_up()
     app.run()
 
 # Or specify port manually:
@@ -0,0 +1,110 @@
+"""Template render time versus item count for the listing and detail pages.
+
+    python benchmarks/render.py
+    python benchmarks/render.py --counts 10 100 1000 --budget 40
+
+Renders each page from synthetic data shaped like the controllers' (no
+database needed) and prints milliseconds per render and microseconds per
+item. With --budget, exits non-zero if any page takes more than that many
+microseconds per item at the largest count, so it can run in CI.
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template
+
+from app import app
+
+
+def show(i):
+    return {
+        'show_id': i,
+        'start_time': datetime(2030, 1, 1, 20, 0) + timedelta(days=i % 365, hours=i % 4),
+        'series_id': None,
+        'artist_id': i,
+        'artist_name': f'Artist {i}',
+        'artist_image_link': f'https://images.example.com/artists/{i}.jpg',
+        'venue_id': i,
+        'venue_name': f'Venue {i}',
+        'venue_image_link': f'https://images.example.com/venues/{i}.jpg',
+    }
+
+
+def entity(kind, count):
+    shows = [show(i) for i in range(count)]
+    return {
+        'id': 1, 'name': f'The {kind}', 'genres': ['Jazz', 'Swing'], 'city': 'San Francisco', 'state': 'CA',
+        'address': '1015 Folsom Street', 'phone': '123-123-1234', 'website': 'https://example.com',
+        'facebook_link': 'https://www.facebook.com/example', 'seeking_talent': True, 'seeking_venue': True,
+        'seeking_description': 'Looking', 'image_link': 'https://images.example.com/1.jpg',
+        'upcoming_shows': shows[:count // 2], 'upcoming_shows_count': count // 2,
+        'past_shows': shows[count // 2:], 'past_shows_count': count - count // 2,
+    }
+
+
+def facets():
+    return {'genres': [('Jazz', 3), ('Swing', 1)], 'states': [('CA', 2), ('NY', 2)]}
+
+
+def filters():
+    return {'genres': [], 'genre_match': 'any', 'state': None, 'seeking': None}
+
+
+PAGES = {
+    'shows': lambda n: ('pages/shows.html', {'shows': [show(i) for i in range(n)], 'period': 'upcoming'}),
+    'search_shows': lambda n: ('pages/search_shows.html', {
+        'results': {'count': n, 'data': [show(i) for i in range(n)]},
+        'search_term': 'a', 'facets': facets(), 'filters': filters()}),
+    'venues': lambda n: ('pages/venues.html', {
+        'areas': [{'city': f'City {c}', 'state': 'CA', 'venues': [{'id': i, 'name': f'Venue {i}'} for i in range(c, n, 10)]}
+            for c in range(min(n, 10))],
+        'facets': facets(), 'filters': filters()}),
+    'artists': lambda n: ('pages/artists.html', {
+        'artists': [{'id': i, 'name': f'Artist {i}'} for i in range(n)], 'facets': facets(), 'filters': filters()}),
+    'show_venue': lambda n: ('pages/show_venue.html', {'venue': entity('venue', n)}),
+    'show_artist': lambda n: ('pages/show_artist.html', {'artist': entity('artist', n)}),
+}
+
+
+def render_time(template, context, repeat):
+    # best of repeat, after one warm-up render that compiles (or loads) the template
+    render_template(template, **context)
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        render_template(template, **context)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', type=int, nargs='+', default=[10, 100, 1000, 5000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--pages', nargs='+', choices=sorted(PAGES), default=sorted(PAGES))
+    parser.add_argument('--budget', type=float, help='Fail above this many microseconds per item.')
+    args = parser.parse_args()
+
+    over_budget = []
+    print(f'{"page":<14}{"items":>8}{"ms":>10}{"us/item":>10}')
+    with app.test_request_context('/'):
+        for page in args.pages:
+            for count in args.counts:
+                template, context = PAGES[page](count)
+                seconds = render_time(template, context, args.repeat)
+                per_item = seconds * 1e6 / count
+                print(f'{page:<14}{count:>8}{seconds * 1000:>10.2f}{per_item:>10.1f}')
+            if args.budget is not None and per_item > args.budget:
+                over_budget.append(page)
+    if over_budget:
+        print(f'over {args.budget}us/item: {", ".join(over_budget)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Memory per worker and cold-start latency of the gunicorn setup, with and without preload.
+
+    DATABASE_URL=postgresql+psycopg2://... python benchmarks/server.py --workers 4
+
+For each mode, starts gunicorn with gunicorn.conf.py, times how long it
+takes until it answers, then the first request to each page (served by
+a fresh worker), and reads the workers' memory from /proc (Linux only):
+RSS, PSS (shared pages split between the processes sharing them) and
+USS (pages private to the worker, i.e. what each extra worker costs).
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PAGES = ['/', '/venues', '/artists', '/shows']
+
+
+def memory(pid):
+    # kB figures from smaps_rollup
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as rollup:
+        for line in rollup:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                values[parts[0].rstrip(':')] = int(parts[1])
+    return {
+        'rss': values['Rss'],
+        'pss': values['Pss'],
+        'uss': values['Private_Clean'] + values['Private_Dirty'],
+    }
+
+
+def children(pid):
+    with open(f'/proc/{pid}/task/{pid}/children') as listing:
+        return [int(child) for child in listing.read().split()]
+
+
+def get(url):
+    started = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+    return time.perf_counter() - started
+
+
+def run(preload, workers, port):
+    env = dict(os.environ, GUNICORN_PRELOAD='1' if preload else '0', WEB_CONCURRENCY=str(workers),
+        GUNICORN_BIND=f'127.0.0.1:{port}')
+    started = time.perf_counter()
+    master = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:app'],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{port}'
+    try:
+        while True:
+            if master.poll() is not None:
+                raise SystemExit('gunicorn exited; run it by hand to see why')
+            try:
+                get(base + '/')
+                break
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.01)
+        ready = time.perf_counter() - started
+        while len(children(master.pid)) < workers:
+            time.sleep(0.05)
+        # one worker served '/' already; these mostly land on fresh ones
+        first = {page: get(base + page) for page in PAGES}
+        for _ in range(20):
+            for page in PAGES:
+                get(base + page)
+        usage = [memory(pid) for pid in children(master.pid)]
+        return {
+            'ready': ready,
+            'first': first,
+            'master': memory(master.pid),
+            'workers': {key: sum(worker[key] for worker in usage) / len(usage) for key in ('rss', 'pss', 'uss')},
+        }
+    finally:
+        master.send_signal(signal.SIGTERM)
+        master.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    for preload in (False, True):
+        result = run(preload, args.workers, args.port)
+        print(f'preload={"on" if preload else "off"}: answering after {result["ready"] * 1000:.0f} ms')
+        print('  first request: ' + ', '.join(f'{page} {seconds * 1000:.1f} ms'
+            for page, seconds in result['first'].items()))
+        print(f'  master: rss {result["master"]["rss"] / 1024:.1f} MB')
+        workers = result['workers']
+        print(f'  per worker: rss {workers["rss"] / 1024:.1f} MB, pss {workers["pss"] / 1024:.1f} MB,'
+            f' uss {workers["uss"] / 1024:.1f} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+import threading
+from collections import deque
+
+
+class Broker:
+    """In-process fan-out of events to any number of waiting subscribers.
+
+    Events sit in a bounded ring buffer under increasing sequence numbers.
+    Subscribers keep nothing but the last sequence number they have seen and
+    all block on one condition, so an idle subscriber costs a parked thread
+    (or greenlet under gevent) and a publish is a single notify_all.
+    """
+
+    def __init__(self, size=1000):
+        self.events = deque(maxlen=size)
+        self.sequence = 0
+        self.condition = threading.Condition()
+
+    def publish(self, event):
+        with self.condition:
+            self.sequence += 1
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def cursor(self):
+        return self.sequence
+
+    def wait(self, cursor, timeout=None):
+        """Return (new cursor, events published after cursor), blocking up to timeout."""
+        with self.condition:
+            if self.sequence <= cursor:
+                self.condition.wait(timeout)
+            # a subscriber that fell further behind than the buffer only
+            # gets what is still buffered
+            missed = min(self.sequence - cursor, len(self.events))
+            events = [self.events[-i] for i in range(missed, 0, -1)]
+            return self.sequence, events
@@ -0,0 +1,153 @@
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class Record:
+    """Reference data for one venue or artist.
+
+    __slots__ keeps a record to a fixed handful of pointers, and the
+    repeated strings (city, state, genre lists) are interned or shared so
+    thousands of venues in one city hold a single copy of its name.
+    """
+
+    __slots__ = ('id', 'name', 'folded_name', 'image_link', 'city', 'state', 'genres', 'seeking')
+
+    def __init__(self, id, name, image_link, city, state, genres, seeking):
+        self.id = id
+        self.name = name
+        self.folded_name = name.casefold()
+        self.image_link = image_link
+        self.city = city
+        self.state = state
+        self.genres = genres
+        self.seeking = seeking
+
+
+class Catalog:
+    """Per-worker snapshot of venues and artists, kept current from a change feed.
+
+    The snapshot is read without locks; refresh() swaps individual records
+    in and out of the dicts, which readers see either before or after.
+    """
+
+    def __init__(self):
+        self.records = {'venue': {}, 'artist': {}}
+        self.genre_lists = {}
+        self.since = None
+        self.checked_at = 0
+        self.loaded = False
+        self.load_lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+
+    def record(self, id, name, image_link, city, state, genres, seeking):
+        genres = tuple(sys.intern(genre) for genre in genres or ())
+        genres = self.genre_lists.setdefault(genres, genres)
+        return Record(id, name, image_link, sys.intern(city), sys.intern(state), genres, seeking)
+
+    def load(self, since, rows):
+        # rows: (kind, id, name, image_link, city, state, genres, seeking)
+        records = {'venue': {}, 'artist': {}}
+        for kind, *fields in rows:
+            records[kind][fields[0]] = self.record(*fields)
+        self.records = records
+        self.since = since
+        self.checked_at = time.monotonic()
+        self.loaded = True
+
+    def load_once(self, source):
+        with self.load_lock:
+            if not self.loaded:
+                self.load(*source())
+        return self
+
+    def refresh_due(self, interval):
+        return time.monotonic() - self.checked_at >= interval
+
+    def refresh(self, source):
+        """Apply changes since the last check; source(since) -> (since, changed, rows).
+
+        changed maps kind to the ids the feed reported; ids that come back
+        without a row were deleted. Only one thread refreshes at a time, the
+        others keep serving the current snapshot.
+        """
+        if not self.refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            since, changed, rows = source(self.since)
+            for kind, *fields in rows:
+                self.records[kind][fields[0]] = self.record(*fields)
+            found = {(kind, fields[0]) for kind, *fields in rows}
+            for kind, ids in changed.items():
+                for entity_id in ids:
+                    if (kind, entity_id) not in found:
+                        self.records[kind].pop(entity_id, None)
+            self.since = since
+            self.checked_at = time.monotonic()
+            return changed, rows
+        finally:
+            self.refresh_lock.release()
+
+    def expire(self):
+        # make the next request check the feed, e.g. right after a local write
+        self.checked_at = 0
+
+    def get(self, kind, entity_id):
+        return self.records[kind].get(entity_id)
+
+    def select(self, kind, filters, search_term=None):
+        term = search_term.casefold() if search_term else None
+        genres = set(filters['genres'])
+        matching = []
+        for record in list(self.records[kind].values()):
+            if term is not None and term not in record.folded_name:
+                continue
+            if genres:
+                if filters['genre_match'] == 'all':
+                    if not genres.issubset(record.genres):
+                        continue
+                elif genres.isdisjoint(record.genres):
+                    continue
+            if filters['state'] and record.state != filters['state']:
+                continue
+            if filters['seeking'] is not None and record.seeking != filters['seeking']:
+                continue
+            matching.append(record)
+        return matching
+
+    def facets(self, records, genre_order):
+        genres = Counter(genre for record in records for genre in record.genres)
+        states = Counter(record.state for record in records)
+        return {
+            'genres': [(genre, genres[genre]) for genre in genre_order if genre in genres],
+            'states': sorted(states.items()),
+        }
+
+    def memory_usage(self):
+        # strings shared between records (interned city/state/genres) are
+        # counted once
+        seen = set()
+
+        def size(value):
+            if id(value) in seen:
+                return 0
+            seen.add(id(value))
+            return sys.getsizeof(value)
+
+        report = {}
+        total = 0
+        for kind, records in self.records.items():
+            kind_size = sys.getsizeof(records)
+            for record in list(records.values()):
+                kind_size += size(record) + size(record.name) + size(record.folded_name) \
+                    + size(record.image_link) + size(record.city) + size(record.state) \
+                    + size(record.genres) + sum(size(genre) for genre in record.genres)
+            report[kind + 's'] = {
+                'count': len(records),
+                'bytes': kind_size,
+                'bytes_per_entity': round(kind_size / len(records)) if records else 0,
+            }
+            total += kind_size
+        report['bytes'] = total
+        return report
@@ -0,0 +1,294 @@
+import itertools
+import re
+import threading
+import time
+import zlib
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# set by the app for each request to the URL rule it matched, so the stats
+# group /venues/1 and /venues/2 together
+ROUTE_KEY = 'compression.route'
+
+COMPRESSIBLE = {'application/json', 'application/javascript', 'application/xml', 'application/rss+xml',
+    'image/svg+xml'}
+
+# a whitespace run with a line break in it: template indentation and blank
+# lines. Runs within a line are left alone, so attribute values and inline
+# text render exactly as before.
+INDENT = re.compile(rb'[ \t\r\f\v]*\n\s*')
+RAW_START = re.compile(rb'<(pre|textarea|script|style)\b', re.IGNORECASE)
+WHITESPACE = b' \t\r\n\f\v'
+
+# bodies of known length up to this size are transformed in one piece
+WHOLE_LIMIT = 1 << 20
+
+
+class HtmlMinifier:
+    """Streaming whitespace reducer for UTF-8 HTML.
+
+    Each whitespace run containing a line break becomes a single line
+    break; contents of <pre>, <textarea>, <script> and <style> pass through
+    untouched. Input may be split anywhere: the tail that could continue a
+    run or a tag is held back until the next chunk.
+    """
+
+    def __init__(self):
+        self.pending = b''
+        self.raw_end = None
+
+    def feed(self, data):
+        data = self.pending + data
+        output = []
+        position = 0
+        while True:
+            if self.raw_end is not None:
+                end = self.raw_end.search(data, position)
+                if end is None:
+                    # the end tag may be split over this chunk and the next
+                    keep = max(position, len(data) - 10)
+                    output.append(data[position:keep])
+                    self.pending = data[keep:]
+                    return b''.join(output)
+                output.append(data[position:end.start()])
+                position = end.start()
+                self.raw_end = None
+            start = RAW_START.search(data, position)
+            if start is None:
+                cut = data.rfind(b'<', position)
+                if cut == -1:
+                    cut = len(data)
+                while cut > position and data[cut - 1] in WHITESPACE:
+                    cut -= 1
+                output.append(INDENT.sub(b'\n', data[position:cut]))
+                self.pending = data[cut:]
+                return b''.join(output)
+            output.append(INDENT.sub(b'\n', data[position:start.end()]))
+            self.raw_end = re.compile(rb'</' + start.group(1) + rb'\b', re.IGNORECASE)
+            position = start.end()
+
+    def close(self):
+        data, self.pending = self.pending, b''
+        return data if self.raw_end is not None else INDENT.sub(b'\n', data)
+
+
+def negotiate(accept_encoding):
+    """The best encoding the client accepts, brotli first when available, or None."""
+    accepted = parse_accept_header(accept_encoding)
+    for encoding in (('br', 'gzip') if brotli is not None else ('gzip',)):
+        if accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def open_stream(encoding, level):
+    # (compress, flush, finish): compress returns what is ready so far, flush
+    # everything fed in up to now so the client can decode it, finish the rest
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        return compressor.process, compressor.flush, compressor.finish
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+class CompressionStats:
+    """Bytes in and out and CPU time of the middleware, per route."""
+
+    def __init__(self):
+        self.routes = {}
+        self.lock = threading.Lock()
+
+    def record(self, route, encoding, bytes_in, bytes_out, cpu):
+        with self.lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {'responses': 0, 'bytes_in': 0, 'bytes_out': 0, 'cpu': 0.0,
+                    'encodings': {}}
+            entry['responses'] += 1
+            entry['bytes_in'] += bytes_in
+            entry['bytes_out'] += bytes_out
+            entry['cpu'] += cpu
+            encoding = encoding or 'identity'
+            entry['encodings'][encoding] = entry['encodings'].get(encoding, 0) + 1
+
+    def report(self):
+        with self.lock:
+            return {route: {
+                'responses': entry['responses'],
+                'bytes_in': entry['bytes_in'],
+                'bytes_out': entry['bytes_out'],
+                'bytes_saved': entry['bytes_in'] - entry['bytes_out'],
+                'ratio': round(entry['bytes_out'] / entry['bytes_in'], 3) if entry['bytes_in'] else None,
+                'cpu_ms': round(entry['cpu'] * 1000, 1),
+                # what the levels cost: CPU per MB that went in
+                'cpu_ms_per_mb': round(entry['cpu'] * 1000 / (entry['bytes_in'] / 1e6), 1) if entry['bytes_in'] else None,
+                'encodings': dict(entry['encodings']),
+            } for route, entry in sorted(self.routes.items())}
+
+
+class CompressionMiddleware:
+    """WSGI middleware minifying HTML and compressing text responses.
+
+    The encoding is negotiated from Accept-Encoding. Bodies shorter than
+    min_size go out uncompressed; for streamed bodies of unknown length
+    that is decided once min_size bytes have arrived, and from then on
+    each chunk is compressed as it comes, so streamed responses keep
+    streaming. Responses that are already encoded, marked no-transform,
+    server-sent events or not text pass through untouched (and keep the
+    server's file wrapper).
+    """
+
+    def __init__(self, app, stats=None, min_size=1024, gzip_level=6, brotli_level=4, minify=True):
+        self.app = app
+        self.stats = stats
+        self.min_size = min_size
+        self.levels = {'gzip': gzip_level, 'br': brotli_level}
+        self.minify = minify
+
+    def __call__(self, environ, start_response):
+        state = {}
+
+        def capture(status, headers, exc_info=None):
+            if exc_info is not None and state.get('started'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            plan = self.plan(environ, status, headers)
+            if plan is None:
+                state['passthrough'] = True
+                return start_response(status, headers, exc_info)
+            state.update(status=status, headers=headers, exc_info=exc_info, plan=plan)
+            return state.setdefault('written', []).append
+
+        body = self.app(environ, capture)
+        if state.get('passthrough'):
+            return body
+        return self.transform(environ, start_response, state, body)
+
+    def plan(self, environ, status, headers):
+        """(encoding or None, minify) for a response, or None to pass it through."""
+        code = int(status[:3])
+        if environ.get('REQUEST_METHOD') == 'HEAD' or code < 200 or code in (204, 206, 304):
+            return None
+        values = {name.lower(): value for name, value in headers}
+        content_type = values.get('content-type', '').lower()
+        mimetype = content_type.split(';')[0].strip()
+        if mimetype == 'text/event-stream':
+            # every event has to reach the client as soon as it is written
+            return None
+        if not (mimetype.startswith('text/') or mimetype in COMPRESSIBLE):
+            return None
+        if 'content-encoding' in values or 'no-transform' in values.get('cache-control', ''):
+            return None
+        # the body differs by Accept-Encoding from here on, compressed or not
+        vary = values.get('vary')
+        if vary is None:
+            headers.append(('Vary', 'Accept-Encoding'))
+        elif 'accept-encoding' not in vary.lower() and vary != '*':
+            headers[:] = [(name, value + ', Accept-Encoding' if name.lower() == 'vary' else value)
+                for name, value in headers]
+        charset = content_type.partition('charset=')[2].strip()
+        minify = self.minify and mimetype == 'text/html' and charset in ('', 'utf-8')
+        encoding = negotiate(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        length = values.get('content-length', '')
+        if length.isdigit() and int(length) < self.min_size:
+            encoding = None
+        if encoding is None and not minify:
+            return None
+        return encoding, minify
+
+    def transform(self, environ, start_response, state, body):
+        cpu = 0.0
+        bytes_in = bytes_out = 0
+        encoding = None
+
+        def timed(function, *args):
+            nonlocal cpu
+            started = time.thread_time()
+            result = function(*args)
+            cpu += time.thread_time() - started
+            return result
+
+        try:
+            chunks = iter(body)
+            if 'plan' not in state and not state.get('passthrough'):
+                # an app may call start_response as it yields its first chunk
+                chunks = itertools.chain([next(chunks, b'')], chunks)
+            if state.get('passthrough'):
+                yield from chunks
+                return
+            encoding, minify = state['plan']
+            minifier = HtmlMinifier() if minify else None
+
+            def source():
+                nonlocal bytes_in
+                for chunk in itertools.chain(state.get('written', []), chunks):
+                    bytes_in += len(chunk)
+                    yield timed(minifier.feed, chunk) if minifier is not None else chunk
+                if minifier is not None:
+                    yield timed(minifier.close)
+
+            # hold the start of the body until it is clear whether it
+            # reaches min_size. A body the app knew the length of is taken
+            # whole, up to WHOLE_LIMIT, so it keeps a Content-Length.
+            length = dict((name.lower(), value) for name, value in state['headers']).get('content-length', '')
+            limit = self.min_size
+            if length.isdigit() and int(length) <= WHOLE_LIMIT:
+                limit = int(length) + 1
+            output = source()
+            buffered = []
+            size = 0
+            ended = False
+            for chunk in output:
+                buffered.append(chunk)
+                size += len(chunk)
+                if size >= limit:
+                    break
+            else:
+                ended = True
+                if size < self.min_size:
+                    encoding = None
+
+            headers = [(name, value) for name, value in state['headers'] if name.lower() != 'content-length']
+            if encoding is not None:
+                headers.append(('Content-Encoding', encoding))
+                # as nginx does: the bytes differ but the representation is
+                # equivalent, and If-None-Match compares weakly
+                headers = [(name, 'W/' + value if name.lower() == 'etag' and not value.startswith('W/') else value)
+                    for name, value in headers]
+            if ended:
+                if encoding is not None:
+                    compress, flush, finish = open_stream(encoding, self.levels[encoding])
+                    buffered = [timed(compress, b''.join(buffered)) + timed(finish)]
+                headers.append(('Content-Length', str(sum(len(chunk) for chunk in buffered))))
+            state['started'] = True
+            start_response(state['status'], headers, state['exc_info'])
+
+            if encoding is None or ended:
+                for chunk in itertools.chain(buffered, output):
+                    if chunk:
+                        bytes_out += len(chunk)
+                        yield chunk
+            else:
+                compress, flush, finish = open_stream(encoding, self.levels[encoding])
+                for chunk in itertools.chain([b''.join(buffered)], output):
+                    if not chunk:
+                        continue
+                    # flushed after every chunk the app yields: the
+                    # compressor would otherwise hold a slow stream's
+                    # output until its buffer fills
+                    data = timed(compress, chunk) + timed(flush)
+                    if data:
+                        bytes_out += len(data)
+                        yield data
+                data = timed(finish)
+                bytes_out += len(data)
+                yield data
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+            if self.stats is not None and state.get('started'):
+                self.stats.record(environ.get(ROUTE_KEY) or 'other', encoding, bytes_in, bytes_out, cpu)
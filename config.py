@@ -1,13 +1,103 @@
 import os
-SECRET_KEY = os.urandom(32)
+# Set SECRET_KEY when serving with more than one process or across restarts,
+# otherwise sessions and CSRF tokens only hold within one process's lifetime.
+SECRET_KEY = os.environ.get('SECRET_KEY') or os.urandom(32)
 # Grabs the folder where the script runs.
 basedir = os.path.abspath(os.path.dirname(__file__))
 
-# Enable debug mode.
-DEBUG = True
+# Enable debug mode. On by default for the development server;
+# gunicorn.conf.py sets FLASK_DEBUG=0.
+DEBUG = os.environ.get('FLASK_DEBUG', '1') == '1'
+
+# Compiled Jinja templates, shared by all workers on the host.
+TEMPLATE_CACHE_DIR = os.path.join(basedir, '.jinja_cache')
+
+# Text responses of at least COMPRESSION_MIN_SIZE bytes are gzip (or brotli,
+# when the brotli package is installed) compressed at these levels, and HTML
+# has its indentation removed first with HTML_MINIFY. Set COMPRESSION=0 when
+# a proxy in front already compresses.
+COMPRESSION = os.environ.get('COMPRESSION', '1') == '1'
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSION_GZIP_LEVEL = 6
+COMPRESSION_BROTLI_LEVEL = 4
+HTML_MINIFY = True
 
 # Connect to the database
 
 
 # TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://carolmartin@localhost:5432/fyyur'
+SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql+psycopg2://carolmartin@localhost:5432/fyyur')
+
+# Background jobs: seconds an idle worker sleeps between polls, and seconds
+# before a running job whose worker died is handed to another worker.
+JOB_POLL_INTERVAL = 1
+JOB_TIMEOUT = 300
+
+# Shows are partitioned by month: partitions are created this many months
+# ahead, and partitions older than SHOW_ARCHIVE_AFTER_MONTHS are detached,
+# dumped to SHOW_ARCHIVE_DIR as gzipped CSV and dropped. New shows can only
+# be listed between the two.
+SHOW_PARTITION_MONTHS_AHEAD = 12
+SHOW_ARCHIVE_AFTER_MONTHS = 36
+SHOW_ARCHIVE_DIR = os.path.join(basedir, 'archive')
+
+# `flask sitemap build` (or the build_sitemaps job) writes the sitemap index
+# and its gzipped chunks to SITEMAP_DIR, served at /sitemap.xml and
+# /sitemaps/; SITEMAP_BASE_URL is the public address their URLs start with.
+SITEMAP_DIR = os.path.join(basedir, 'sitemaps')
+SITEMAP_BASE_URL = os.environ.get('SITEMAP_BASE_URL', 'http://localhost:5000')
+
+# An artist can't have two shows starting within SHOW_CLASH_HOURS of each
+# other (a venue can host several acts a night), and a recurring show expands
+# to at most SHOW_SERIES_MAX_SHOWS.
+SHOW_CLASH_HOURS = 3
+SHOW_SERIES_MAX_SHOWS = 366
+
+# /shows?from=&to=&city=&state=&genre= lists at most SHOWS_BROWSE_LIMIT shows
+# over at most SHOWS_BROWSE_MAX_DAYS days.
+SHOWS_BROWSE_MAX_DAYS = 31
+SHOWS_BROWSE_LIMIT = 500
+
+# Venues/artists in the same city scoring at least this (0-1, mostly name
+# similarity, then address and phone) are flagged as likely duplicates.
+DEDUP_THRESHOLD = 0.75
+
+# /shows/stream: 'local' publishes new shows to the worker that created them
+# only; 'postgres' uses LISTEN/NOTIFY so every worker sees every show.
+# gunicorn.conf.py defaults to 'postgres' (and CATALOG_SNAPSHOT=1) when it
+# runs more than one worker, and to gevent workers for the idle connections.
+SHOW_EVENTS_BACKEND = os.environ.get('SHOW_EVENTS_BACKEND', 'local')
+SHOW_EVENTS_BUFFER = 1000
+SHOW_EVENTS_HEARTBEAT = 15
+SHOW_EVENTS_RESUME_LIMIT = 500
+
+# Per-worker snapshot of venue/artist names, images, locations and genres used
+# by the listing and search pages instead of querying those tables. Each
+# worker checks the catalog_changes feed at most every
+# CATALOG_REFRESH_INTERVAL seconds and re-reads the last
+# CATALOG_CHANGE_MARGIN seconds of it to catch late-committing writes.
+CATALOG_SNAPSHOT = os.environ.get('CATALOG_SNAPSHOT') == '1'
+CATALOG_REFRESH_INTERVAL = 1
+CATALOG_CHANGE_MARGIN = 30
+
+# Admission control for the search and write endpoints. Every client IP has
+# a token bucket per policy (rate requests a second, bursts of up to burst),
+# and at most concurrency requests of a policy run at once in each worker,
+# with up to queue more waiting RATE_LIMIT_QUEUE_TIMEOUT seconds for a slot.
+# Anything over gets 429 with Retry-After. The buckets are per worker with
+# 'local'; 'postgres' shares them across workers and hosts.
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'local')
+RATE_LIMITS = {
+    'search': {'rate': 2, 'burst': 10, 'concurrency': 4, 'queue': 16},
+    'write': {'rate': 0.5, 'burst': 5, 'concurrency': 4, 'queue': 8},
+}
+RATE_LIMIT_QUEUE_TIMEOUT = 2
+
+# /venues/<id>/calendar.ics and /artists/<id>/calendar.ics list shows from
+# CALENDAR_PAST_DAYS ago on, each CALENDAR_SHOW_HOURS long. Each worker keeps
+# up to CALENDAR_CACHE_SIZE serialized feeds, and clients may reuse one for
+# CALENDAR_MAX_AGE seconds before revalidating it.
+CALENDAR_CACHE_SIZE = 1000
+CALENDAR_PAST_DAYS = 90
+CALENDAR_SHOW_HOURS = 3
+CALENDAR_MAX_AGE = 300
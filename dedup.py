@@ -0,0 +1,146 @@
+import hashlib
+import re
+import zlib
+from collections import defaultdict
+from itertools import combinations
+
+# words that say nothing about which venue or artist it is
+STOPWORDS = {'the', 'and', 'a', 'an', 'of', 'at', 'live', 'band', 'bar', 'club'}
+ABBREVIATIONS = {'st': 'street', 'ave': 'avenue', 'rd': 'road', 'blvd': 'boulevard', 'n': 'north',
+    's': 'south', 'e': 'east', 'w': 'west'}
+
+# weights of the field similarities in a score; phone is compared exactly
+WEIGHTS = {'name': 0.6, 'address': 0.25, 'phone': 0.15}
+
+# MinHash: 16 bands of 4 rows put pairs with a name similarity of about 0.5
+# and above in a shared bucket
+BANDS = 16
+ROWS = 4
+PRIME = (1 << 61) - 1
+PERMUTATIONS = [(1 + 2 * i * 0x9E3779B1 % PRIME, 7 + i * 0x85EBCA77 % PRIME) for i in range(BANDS * ROWS)]
+
+# blocks up to this size are compared pairwise, bigger ones go through LSH
+PAIRWISE_LIMIT = 200
+
+
+def words(text):
+    words = re.sub(r'[^\w\s]', ' ', (text or '').casefold().replace('&', ' and ')).split()
+    return [ABBREVIATIONS.get(word, word) for word in words]
+
+
+def normalize_name(name):
+    kept = [word for word in words(name) if word not in STOPWORDS]
+    # a name made only of stopwords ("The Band") is kept as it is
+    return ' '.join(kept or words(name))
+
+
+def normalize_address(address):
+    return ' '.join(words(address))
+
+
+def normalize_phone(phone):
+    return re.sub(r'\D', '', phone or '')[-10:]
+
+
+def trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class Record:
+    """The normalized fields of one venue or artist that duplicates are judged on."""
+
+    __slots__ = ('id', 'name', 'name_grams', 'address_grams', 'phone')
+
+    def __init__(self, id, name, address, phone):
+        self.id = id
+        self.name = name
+        self.name_grams = trigrams(normalize_name(name))
+        self.address_grams = trigrams(normalize_address(address)) if address else None
+        self.phone = normalize_phone(phone)
+
+
+def score(a, b):
+    """Similarity of two records between 0 and 1.
+
+    Fields missing on either side (artists have no address) drop out and
+    the remaining weights are scaled up.
+    """
+    total = WEIGHTS['name'] * jaccard(a.name_grams, b.name_grams)
+    weight = WEIGHTS['name']
+    if a.address_grams and b.address_grams:
+        total += WEIGHTS['address'] * jaccard(a.address_grams, b.address_grams)
+        weight += WEIGHTS['address']
+    if a.phone and b.phone:
+        total += WEIGHTS['phone'] * (a.phone == b.phone)
+        weight += WEIGHTS['phone']
+    return total / weight
+
+
+def matches(record, candidates, threshold):
+    """(score, candidate) for the candidates scoring at least threshold, best first."""
+    found = [(score(record, candidate), candidate) for candidate in candidates if candidate.id != record.id]
+    return sorted([match for match in found if match[0] >= threshold], key=lambda match: -match[0])
+
+
+def signature(grams):
+    hashes = [zlib.crc32(gram.encode()) for gram in grams] or [0]
+    return [min((a * value + b) % PRIME for value in hashes) for a, b in PERMUTATIONS]
+
+
+def bands(grams):
+    """The LSH bucket keys of a MinHash signature, one signed 64-bit int per band.
+
+    Stored with each venue and artist (name_bands) so the records sharing a
+    bucket with a new name are an index lookup.
+    """
+    values = signature(grams)
+    keys = []
+    for band in range(BANDS):
+        digest = hashlib.blake2b(repr((band, values[band * ROWS:(band + 1) * ROWS])).encode(), digest_size=8).digest()
+        keys.append(int.from_bytes(digest, 'big', signed=True))
+    return keys
+
+
+def name_bands(name):
+    return bands(trigrams(normalize_name(name)))
+
+
+def candidate_pairs(records):
+    """Pairs of records sharing at least one LSH bucket of their name MinHash."""
+    buckets = defaultdict(list)
+    for record in records:
+        for key in bands(record.name_grams):
+            buckets[key].append(record)
+    pairs = {}
+    for bucket in buckets.values():
+        for a, b in combinations(bucket, 2):
+            pairs[(min(a.id, b.id), max(a.id, b.id))] = (a, b)
+    return pairs.values()
+
+
+def duplicate_pairs(block, threshold):
+    """(score, a, b) for the likely duplicates within one block, a.id < b.id.
+
+    Small blocks are compared pairwise; in big ones only the pairs LSH
+    puts together are scored, which keeps a block linear rather than
+    quadratic in its size.
+    """
+    if len(block) <= PAIRWISE_LIMIT:
+        pairs = combinations(block, 2)
+    else:
+        pairs = candidate_pairs(block)
+    found = []
+    for a, b in pairs:
+        if a.id > b.id:
+            a, b = b, a
+        similarity = score(a, b)
+        if similarity >= threshold:
+            found.append((similarity, a, b))
+    return found
@@ -0,0 +1,93 @@
+import csv
+import gzip
+import json
+import os
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ('parquet', 'arrow', 'csv')
+EXTENSIONS = {'parquet': '.parquet', 'arrow': '.arrow', 'csv': '.csv.gz'}
+
+
+def available_format(requested):
+    # columnar formats need pyarrow; without it everything is gzipped CSV
+    if requested != 'csv' and pyarrow is None:
+        return 'csv'
+    return requested
+
+
+def write_chunk(path, columns, rows, format):
+    """Write rows (a list of tuples) to path + extension, atomically."""
+    path += EXTENSIONS[format]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = path + '.partial'
+    if format == 'csv':
+        with gzip.open(partial, 'wt', newline='') as output:
+            writer = csv.writer(output)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow([json.dumps(value) if isinstance(value, list) else value for value in row])
+    else:
+        table = pyarrow.table({name: [row[i] for row in rows] for i, name in enumerate(columns)})
+        if format == 'parquet':
+            pyarrow.parquet.write_table(table, partial, compression='zstd')
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression='zstd')
+            with pyarrow.ipc.new_file(partial, table.schema, options=options) as writer:
+                writer.write_table(table)
+    os.replace(partial, path)
+    return path
+
+
+def load_watermarks(directory):
+    """{table: {'id': highest id exported, 'gaps': [[first, last, seen_at], ...]}}."""
+    try:
+        with open(os.path.join(directory, 'watermarks.json')) as state:
+            watermarks = json.load(state)
+    except FileNotFoundError:
+        return {}
+    # files from before gaps were tracked held just the id
+    return {table: {'id': mark, 'gaps': []} if isinstance(mark, int) else mark for table, mark in watermarks.items()}
+
+
+def find_gaps(ids, after, seen_at):
+    """[first, last, seen_at] for each run of ids missing from sorted ids, counting up from after.
+
+    A missing id is a row that was deleted or rolled back, or one whose
+    transaction had not committed yet (ids are handed out before commit,
+    so a long insert can show up after higher ids did).
+    """
+    gaps = []
+    for row_id in ids:
+        if row_id > after + 1:
+            gaps.append([after + 1, row_id - 1, seen_at])
+        after = row_id
+    return gaps
+
+
+def remaining_gaps(gaps, found):
+    """gaps without the ids in found (sorted), split where an id was filled."""
+    found = sorted(found)
+    remaining = []
+    for first, last, seen_at in gaps:
+        start = first
+        for row_id in found:
+            if first <= row_id <= last:
+                if row_id > start:
+                    remaining.append([start, row_id - 1, seen_at])
+                start = row_id + 1
+        if start <= last:
+            remaining.append([start, last, seen_at])
+    return remaining
+
+
+def save_watermarks(directory, watermarks):
+    path = os.path.join(directory, 'watermarks.json')
+    with open(path + '.partial', 'w') as state:
+        json.dump(watermarks, state, indent=2, sort_keys=True)
+    os.replace(path + '.partial', path)
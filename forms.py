@@ -1,7 +1,8 @@
 from datetime import datetime
 from flask_wtf import FlaskForm
-from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, BooleanField, ValidationError, HiddenField
-from wtforms.validators import DataRequired, AnyOf, URL, Length, Regexp, Optional
+from wtforms import StringField, SelectField, SelectMultipleField, DateTimeField, DateField, TimeField, BooleanField, ValidationError, HiddenField, IntegerField
+from wtforms.widgets import HiddenInput
+from wtforms.validators import DataRequired, AnyOf, URL, Length, Regexp, Optional, NumberRange
 import re
 
 genre_choices = [
@@ -80,6 +81,23 @@ state_choices = [
         ('WY', 'WY')
 ]
 
+repeat_choices = [
+    ('', 'Does not repeat'),
+    ('weekly', 'Weekly'),
+    ('monthly', 'Monthly, same date'),
+    ('monthly_weekday', 'Monthly, same weekday (e.g. 2nd Friday)')
+]
+
+weekday_choices = [
+    ('MO', 'Mon'),
+    ('TU', 'Tue'),
+    ('WE', 'Wed'),
+    ('TH', 'Thu'),
+    ('FR', 'Fri'),
+    ('SA', 'Sat'),
+    ('SU', 'Sun')
+]
+
 def phone_validation(form, field):
     if not re.search(r'^[1-9]\d{2}-\d{3}-\d{4}$', field.data):
         raise ValidationError("error: Phone number should only contain digits (xxx-xxx-xxxx)")
@@ -96,6 +114,43 @@ class ShowForm(FlaskForm):
         validators=[DataRequired()],
         default= datetime.today()
     )
+    # recurring shows: the series repeats every `interval` weeks/months
+    # until a date (inclusive) or for a number of shows
+    repeat = SelectField(
+        'repeat', choices=repeat_choices, default=''
+    )
+    interval = IntegerField(
+        'interval', validators=[Optional(), NumberRange(min=1, max=12)], default=1
+    )
+    weekdays = SelectMultipleField(
+        'weekdays', choices=weekday_choices
+    )
+    until = DateField(
+        'until', validators=[Optional()]
+    )
+    count = IntegerField(
+        'count', validators=[Optional(), NumberRange(min=1)]
+    )
+
+    def validate_repeat(form, field):
+        if field.data and not (form.until.data or form.count.data):
+            raise ValidationError('A repeating show needs an end date or a number of shows')
+
+    def validate_until(form, field):
+        if field.data and form.start_time.data and field.data < form.start_time.data.date():
+            raise ValidationError('The end date is before the first show')
+
+class SeriesForm(FlaskForm):
+    # applies to every upcoming show of a series
+    artist_id = StringField(
+        'artist_id', validators=[DataRequired()]
+    )
+    venue_id = StringField(
+        'venue_id', validators=[DataRequired()]
+    )
+    time = TimeField(
+        'time', validators=[DataRequired()]
+    )
 
 class VenueForm(FlaskForm):
     name = StringField(
@@ -167,4 +222,19 @@ class ArtistForm(FlaskForm):
     seeking_description = StringField(
         'seeking_description'
     )
+class EditFormMixin:
+    # version is the row version the form was rendered from; snapshot holds
+    # the original field values so only changed columns are written back
+    version = IntegerField(
+        'version', validators=[DataRequired()], widget=HiddenInput()
+    )
+    snapshot = HiddenField(
+        'snapshot'
+    )
+
+class EditVenueForm(EditFormMixin, VenueForm):
+    pass
+
+class EditArtistForm(EditFormMixin, ArtistForm):
+    pass
 # TODO IMPLEMENT NEW ARTIST FORM AND NEW SHOW FORM
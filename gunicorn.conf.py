@@ -0,0 +1,102 @@
+"""gunicorn settings, read from the working directory by default:
+
+    gunicorn wsgi:app
+
+The app is imported and warmed up once in the master (preload_app) and the
+workers are forked from it, so they start serving immediately and share
+its memory copy-on-write. Every setting can be overridden on the command
+line or with GUNICORN_CMD_ARGS.
+
+Workers are gevent based by default: /shows/stream keeps a connection open
+per subscriber, which would tie up a whole sync worker (and get it killed
+after timeout). With more than one worker, new shows and catalog edits
+have to reach the others, so the postgres event backend and the catalog
+snapshot are switched on unless set otherwise, and the server refuses to
+start with per-worker ones.
+
+Reloading: HUP re-reads this file and gracefully replaces the workers, but
+does not re-import the preloaded app. To deploy new code without dropping
+requests, send USR2 (starts a new master with new workers alongside the
+old one), then QUIT to the old master once the new one is serving.
+"""
+import gc
+import math
+import multiprocessing
+import os
+
+# must be set before config.py is imported by the preloaded app
+os.environ.setdefault('FLASK_DEBUG', '0')
+
+
+def cpu_limit():
+    # CPUs we may actually use: affinity mask and cgroup v2 quota (containers)
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = multiprocessing.cpu_count()
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as limit:
+            quota, period = limit.read().split()
+        if quota != 'max':
+            cpus = min(cpus, max(1, math.ceil(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+    return cpus
+
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:' + os.environ.get('PORT', '8000'))
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * cpu_limit() + 1))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gevent')
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+# recycle workers every so often, staggered, to hand back memory they grew into
+max_requests = 10000
+max_requests_jitter = 1000
+accesslog = '-'
+
+if worker_class == 'gevent':
+    # before the preloaded app creates any locks, threads or connections;
+    # psycogreen makes queries yield to other greenlets while they wait
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+if workers > 1:
+    # read by config.py when the app is imported
+    os.environ.setdefault('SHOW_EVENTS_BACKEND', 'postgres')
+    os.environ.setdefault('CATALOG_SNAPSHOT', '1')
+
+
+def on_starting(server):
+    import config
+    if server.cfg.workers > 1 and (config.SHOW_EVENTS_BACKEND != 'postgres' or not config.CATALOG_SNAPSHOT):
+        raise RuntimeError('More than one worker needs SHOW_EVENTS_BACKEND=postgres and CATALOG_SNAPSHOT=1, '
+            'otherwise workers miss new shows and edits made in the others')
+    if server.cfg.worker_class_str in ('sync', 'gthread'):
+        server.log.warning('Each /shows/stream subscriber holds a %s worker thread for as long as it is connected',
+            server.cfg.worker_class_str)
+
+
+def when_ready(server):
+    # runs in the master after the preload and before the first fork
+    if not preload_app:
+        return
+    from app import warm_up
+    warm_up()
+    # move everything loaded so far out of the collector's reach: collections
+    # in the workers would otherwise write to (and so copy) every shared page
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # a fork inherits the parent's pool; drop it without closing the
+    # parent's connections so this worker opens its own
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)
@@ -0,0 +1,114 @@
+import threading
+from collections import OrderedDict
+from datetime import timezone
+
+# content lines are at most 75 octets, longer ones continue on the next
+# line after a CRLF and a space (RFC 5545 3.1)
+LINE_LIMIT = 75
+
+
+def escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+
+def fold(line):
+    data = line.encode()
+    if len(data) <= LINE_LIMIT:
+        return line + '\r\n'
+    parts = []
+    start = 0
+    limit = LINE_LIMIT
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # never split a multi-byte character
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode())
+        start = end
+        # continuation lines lose an octet to the leading space
+        limit = LINE_LIMIT - 1
+    return '\r\n '.join(parts) + '\r\n'
+
+
+def format_time(moment):
+    # shows have no time zone, so their times are floating local times;
+    # aware datetimes are written in UTC
+    if moment.tzinfo is not None:
+        return moment.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    return moment.strftime('%Y%m%dT%H%M%S')
+
+
+def header(name, description=None):
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Fyyur//Show calendar//EN',
+        'CALSCALE:GREGORIAN',
+        'METHOD:PUBLISH',
+        'X-WR-CALNAME:' + escape(name),
+    ]
+    if description:
+        lines.append('X-WR-CALDESC:' + escape(description))
+    return ''.join(fold(line) for line in lines)
+
+
+def event(uid, stamp, start, end, summary, location=None, url=None):
+    lines = [
+        'BEGIN:VEVENT',
+        'UID:' + uid,
+        'DTSTAMP:' + format_time(stamp),
+        'DTSTART:' + format_time(start),
+        'DTEND:' + format_time(end),
+        'SUMMARY:' + escape(summary),
+    ]
+    if location:
+        lines.append('LOCATION:' + escape(location))
+    if url:
+        lines.append('URL:' + url)
+    lines.append('END:VEVENT')
+    return ''.join(fold(line) for line in lines)
+
+
+FOOTER = 'END:VCALENDAR\r\n'
+
+
+class FeedCache:
+    """Serialized feeds by key, each valid for one version stamp.
+
+    A feed is only served for the stamp it was built at, so bumping the
+    stamp in the database is all it takes to invalidate it in every
+    worker. Least recently used feeds are dropped past size entries.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.feeds = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, stamp):
+        with self.lock:
+            cached = self.feeds.get(key)
+            if cached is None or cached[0] != stamp:
+                self.misses += 1
+                return None
+            self.feeds.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+    def put(self, key, stamp, body):
+        with self.lock:
+            self.feeds[key] = (stamp, body)
+            self.feeds.move_to_end(key)
+            while len(self.feeds) > self.size:
+                self.feeds.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'feeds': len(self.feeds),
+                'bytes': sum(len(body) for stamp, body in self.feeds.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
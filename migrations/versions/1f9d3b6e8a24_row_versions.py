@@ -0,0 +1,26 @@
+"""version column on venues and artists for optimistic concurrency
+
+Revision ID: 1f9d3b6e8a24
+Revises: c4a7e2b91f08
+Create Date: 2026-10-19 11:26:05.617382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1f9d3b6e8a24'
+down_revision = 'c4a7e2b91f08'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    op.add_column('artists', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade():
+    op.drop_column('artists', 'version')
+    op.drop_column('venues', 'version')
@@ -0,0 +1,30 @@
+"""GIN indexes on genres and state indexes for faceted filtering
+
+Revision ID: 5e1c2a9d7b40
+Revises: 44d583b383cf
+Create Date: 2026-10-19 09:12:41.220417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e1c2a9d7b40'
+down_revision = '44d583b383cf'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_venues_genres', 'venues', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_venues_state_city', 'venues', ['state', 'city'], unique=False)
+    op.create_index('ix_artists_genres', 'artists', ['genres'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artists_state', 'artists', ['state'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_state', table_name='artists')
+    op.drop_index('ix_artists_genres', table_name='artists')
+    op.drop_index('ix_venues_state_city', table_name='venues')
+    op.drop_index('ix_venues_genres', table_name='venues')
@@ -0,0 +1,102 @@
+"""partition shows by month of start_time
+
+Revision ID: 7a2e5c0f4d93
+Revises: 1f9d3b6e8a24
+Create Date: 2026-10-19 12:08:44.381259
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a2e5c0f4d93'
+down_revision = '1f9d3b6e8a24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # partition key has to be NOT NULL and part of the primary key
+    op.execute("""
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM shows WHERE start_time IS NULL) THEN
+                RAISE EXCEPTION 'shows with no start_time must be fixed or removed before partitioning';
+            END IF;
+        END $$;
+    """)
+    op.execute("ALTER SEQUENCE shows_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE shows RENAME TO shows_unpartitioned")
+    op.execute("ALTER TABLE shows_unpartitioned RENAME CONSTRAINT shows_pkey TO shows_unpartitioned_pkey")
+    op.execute("ALTER INDEX ix_shows_venue_id RENAME TO ix_shows_unpartitioned_venue_id")
+    op.execute("ALTER INDEX ix_shows_artist_id RENAME TO ix_shows_unpartitioned_artist_id")
+    op.execute("""
+        CREATE TABLE shows (
+            id integer NOT NULL DEFAULT nextval('shows_id_seq'),
+            start_time timestamp without time zone NOT NULL,
+            artist_id integer REFERENCES artists (id) ON DELETE CASCADE,
+            venue_id integer REFERENCES venues (id) ON DELETE CASCADE,
+            PRIMARY KEY (id, start_time)
+        ) PARTITION BY RANGE (start_time)
+    """)
+    op.execute("ALTER SEQUENCE shows_id_seq OWNED BY shows.id")
+    op.create_index('ix_shows_venue_id', 'shows', ['venue_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_artist_id', 'shows', ['artist_id', 'start_time'], unique=False)
+    op.create_index('ix_shows_start_time', 'shows', ['start_time'], unique=False)
+    # one partition per calendar month, e.g. shows_y2021m03
+    op.execute("""
+        CREATE OR REPLACE FUNCTION create_shows_partition(month date) RETURNS text AS $$
+        DECLARE
+            first_day date := date_trunc('month', month)::date;
+            partition text := 'shows_' || to_char(first_day, '"y"YYYY"m"MM');
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF shows FOR VALUES FROM (%L) TO (%L)',
+                partition, first_day, (first_day + interval '1 month')::date
+            );
+            RETURN partition;
+        EXCEPTION WHEN duplicate_table THEN
+            RETURN partition;
+        END $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        SELECT create_shows_partition(month::date)
+        FROM generate_series(
+            date_trunc('month', LEAST((SELECT min(start_time) FROM shows_unpartitioned), now())),
+            date_trunc('month', GREATEST((SELECT max(start_time) FROM shows_unpartitioned), now() + interval '12 months')),
+            interval '1 month'
+        ) AS month
+    """)
+    op.execute("""
+        INSERT INTO shows (id, start_time, artist_id, venue_id)
+        SELECT id, start_time, artist_id, venue_id FROM shows_unpartitioned
+    """)
+    op.drop_table('shows_unpartitioned')
+
+
+def downgrade():
+    op.execute("ALTER SEQUENCE shows_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE shows RENAME TO shows_partitioned")
+    op.execute("ALTER TABLE shows_partitioned RENAME CONSTRAINT shows_pkey TO shows_partitioned_pkey")
+    op.execute("ALTER INDEX ix_shows_venue_id RENAME TO ix_shows_partitioned_venue_id")
+    op.execute("ALTER INDEX ix_shows_artist_id RENAME TO ix_shows_partitioned_artist_id")
+    op.execute("ALTER INDEX ix_shows_start_time RENAME TO ix_shows_partitioned_start_time")
+    op.create_table('shows',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('shows_id_seq')"), nullable=False),
+    sa.Column('start_time', sa.DateTime(), nullable=True),
+    sa.Column('artist_id', sa.Integer(), nullable=True),
+    sa.Column('venue_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("ALTER SEQUENCE shows_id_seq OWNED BY shows.id")
+    op.create_index('ix_shows_venue_id', 'shows', ['venue_id'], unique=False)
+    op.create_index('ix_shows_artist_id', 'shows', ['artist_id'], unique=False)
+    op.execute("""
+        INSERT INTO shows (id, start_time, artist_id, venue_id)
+        SELECT id, start_time, artist_id, venue_id FROM shows_partitioned
+    """)
+    op.execute("DROP TABLE shows_partitioned")
+    op.execute("DROP FUNCTION create_shows_partition(date)")
@@ -0,0 +1,41 @@
+"""jobs table for the background queue
+
+Revision ID: 8b3f0d6a2c71
+Revises: 5e1c2a9d7b40
+Create Date: 2026-10-19 10:03:17.548210
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '8b3f0d6a2c71'
+down_revision = '5e1c2a9d7b40'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('max_attempts', sa.Integer(), nullable=False),
+    sa.Column('run_at', sa.DateTime(), nullable=False),
+    sa.Column('locked_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_jobs_ready', 'jobs', ['run_at'], unique=False, postgresql_where=sa.text("status = 'queued'"))
+    op.create_index('ix_jobs_running', 'jobs', ['locked_at'], unique=False, postgresql_where=sa.text("status = 'running'"))
+
+
+def downgrade():
+    op.drop_index('ix_jobs_running', table_name='jobs')
+    op.drop_index('ix_jobs_ready', table_name='jobs')
+    op.drop_table('jobs')
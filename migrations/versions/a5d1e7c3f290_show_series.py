@@ -0,0 +1,41 @@
+"""show_series for recurring shows, and shows.series_id
+
+Revision ID: a5d1e7c3f290
+Revises: f3b9c2d7a104
+Create Date: 2026-10-19 18:05:51.637207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5d1e7c3f290'
+down_revision = 'f3b9c2d7a104'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_series',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('artist_id', sa.Integer(), nullable=False),
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('first_start_time', sa.DateTime(), nullable=False),
+    sa.Column('rule', sa.String(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.ForeignKeyConstraint(['artist_id'], ['artists.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    # on the partitioned parent, so every partition gets the column and index
+    op.add_column('shows', sa.Column('series_id', sa.Integer(), nullable=True))
+    op.create_foreign_key('shows_series_id_fkey', 'shows', 'show_series', ['series_id'], ['id'], ondelete='SET NULL')
+    op.create_index('ix_shows_series_id', 'shows', ['series_id', 'start_time'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_shows_series_id', table_name='shows')
+    op.drop_constraint('shows_series_id_fkey', 'shows', type_='foreignkey')
+    op.drop_column('shows', 'series_id')
+    op.drop_table('show_series')
@@ -0,0 +1,38 @@
+"""duplicate_candidates and city blocking indexes for duplicate detection
+
+Revision ID: b7c2f9e4d015
+Revises: a5d1e7c3f290
+Create Date: 2026-10-19 19:22:14.905318
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7c2f9e4d015'
+down_revision = 'a5d1e7c3f290'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('duplicate_candidates',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('duplicate_id', sa.Integer(), nullable=False),
+    sa.Column('score', sa.Float(), nullable=False),
+    sa.Column('dismissed', sa.Boolean(), server_default=sa.false(), nullable=False),
+    sa.Column('found_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'entity_id', 'duplicate_id', name='uq_duplicate_candidates_pair')
+    )
+    op.create_index('ix_venues_dedup_block', 'venues', ['state', sa.text('lower(city)')], unique=False)
+    op.create_index('ix_artists_dedup_block', 'artists', ['state', sa.text('lower(city)')], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_artists_dedup_block', table_name='artists')
+    op.drop_index('ix_venues_dedup_block', table_name='venues')
+    op.drop_table('duplicate_candidates')
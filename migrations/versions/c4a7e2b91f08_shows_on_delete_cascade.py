@@ -0,0 +1,35 @@
+"""ON DELETE CASCADE on shows foreign keys
+
+Revision ID: c4a7e2b91f08
+Revises: 8b3f0d6a2c71
+Create Date: 2026-10-19 10:41:52.903114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a7e2b91f08'
+down_revision = '8b3f0d6a2c71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the cascade looks shows up by venue_id / artist_id, so index them too
+    op.create_index('ix_shows_venue_id', 'shows', ['venue_id'], unique=False)
+    op.create_index('ix_shows_artist_id', 'shows', ['artist_id'], unique=False)
+    op.drop_constraint('shows_venue_id_fkey', 'shows', type_='foreignkey')
+    op.drop_constraint('shows_artist_id_fkey', 'shows', type_='foreignkey')
+    op.create_foreign_key('shows_venue_id_fkey', 'shows', 'venues', ['venue_id'], ['id'], ondelete='CASCADE')
+    op.create_foreign_key('shows_artist_id_fkey', 'shows', 'artists', ['artist_id'], ['id'], ondelete='CASCADE')
+
+
+def downgrade():
+    op.drop_constraint('shows_artist_id_fkey', 'shows', type_='foreignkey')
+    op.drop_constraint('shows_venue_id_fkey', 'shows', type_='foreignkey')
+    op.create_foreign_key('shows_artist_id_fkey', 'shows', 'artists', ['artist_id'], ['id'])
+    op.create_foreign_key('shows_venue_id_fkey', 'shows', 'venues', ['venue_id'], ['id'])
+    op.drop_index('ix_shows_artist_id', table_name='shows')
+    op.drop_index('ix_shows_venue_id', table_name='shows')
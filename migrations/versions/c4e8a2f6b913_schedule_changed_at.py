@@ -0,0 +1,26 @@
+"""schedule_changed_at on venues and artists for calendar feed caching
+
+Revision ID: c4e8a2f6b913
+Revises: b7c2f9e4d015
+Create Date: 2026-10-19 21:05:37.412856
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a2f6b913'
+down_revision = 'b7c2f9e4d015'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('schedule_changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('artists', sa.Column('schedule_changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('artists', 'schedule_changed_at')
+    op.drop_column('venues', 'schedule_changed_at')
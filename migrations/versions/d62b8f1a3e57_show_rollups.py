@@ -0,0 +1,33 @@
+"""show_rollups table for pre-aggregated statistics
+
+Revision ID: d62b8f1a3e57
+Revises: 7a2e5c0f4d93
+Create Date: 2026-10-19 13:47:20.114862
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd62b8f1a3e57'
+down_revision = '7a2e5c0f4d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('show_rollups',
+    sa.Column('period', sa.String(length=10), nullable=False),
+    sa.Column('bucket', sa.Date(), nullable=False),
+    sa.Column('dimension', sa.String(length=20), nullable=False),
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('show_count', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('period', 'bucket', 'dimension', 'key')
+    )
+    op.create_index('ix_show_rollups_dimension', 'show_rollups', ['period', 'dimension', 'bucket'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_show_rollups_dimension', table_name='show_rollups')
+    op.drop_table('show_rollups')
@@ -0,0 +1,26 @@
+"""updated_at on venues and artists for sitemap lastmod
+
+Revision ID: d9a3f5b1c862
+Revises: c4e8a2f6b913
+Create Date: 2026-10-19 22:14:09.538120
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd9a3f5b1c862'
+down_revision = 'c4e8a2f6b913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+    op.add_column('artists', sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False))
+
+
+def downgrade():
+    op.drop_column('artists', 'updated_at')
+    op.drop_column('venues', 'updated_at')
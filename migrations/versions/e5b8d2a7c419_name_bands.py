@@ -0,0 +1,32 @@
+"""name_bands on venues and artists for duplicate lookups at create time
+
+Revision ID: e5b8d2a7c419
+Revises: d9a3f5b1c862
+Create Date: 2026-10-20 10:41:27.306514
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b8d2a7c419'
+down_revision = 'd9a3f5b1c862'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # filled by 'flask dedup scan' for existing rows
+    op.add_column('venues', sa.Column('name_bands', postgresql.ARRAY(sa.BigInteger()), nullable=True))
+    op.add_column('artists', sa.Column('name_bands', postgresql.ARRAY(sa.BigInteger()), nullable=True))
+    op.create_index('ix_venues_name_bands', 'venues', ['name_bands'], unique=False, postgresql_using='gin')
+    op.create_index('ix_artists_name_bands', 'artists', ['name_bands'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_artists_name_bands', table_name='artists')
+    op.drop_index('ix_venues_name_bands', table_name='venues')
+    op.drop_column('artists', 'name_bands')
+    op.drop_column('venues', 'name_bands')
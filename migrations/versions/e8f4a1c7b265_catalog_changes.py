@@ -0,0 +1,32 @@
+"""catalog_changes feed for per-worker catalog snapshots
+
+Revision ID: e8f4a1c7b265
+Revises: d62b8f1a3e57
+Create Date: 2026-10-19 15:02:39.772015
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8f4a1c7b265'
+down_revision = 'd62b8f1a3e57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('catalog_changes',
+    sa.Column('id', sa.BigInteger(), nullable=False),
+    sa.Column('kind', sa.String(length=10), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_catalog_changes_changed_at'), 'catalog_changes', ['changed_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_catalog_changes_changed_at'), table_name='catalog_changes')
+    op.drop_table('catalog_changes')
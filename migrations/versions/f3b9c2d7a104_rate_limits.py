@@ -0,0 +1,29 @@
+"""unlogged rate_limits table for shared token buckets
+
+Revision ID: f3b9c2d7a104
+Revises: e8f4a1c7b265
+Create Date: 2026-10-19 16:41:08.210394
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3b9c2d7a104'
+down_revision = 'e8f4a1c7b265'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('rate_limits',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('tat', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('key'),
+    prefixes=['UNLOGGED']
+    )
+
+
+def downgrade():
+    op.drop_table('rate_limits')
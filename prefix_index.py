@@ -0,0 +1,111 @@
+import sys
+import threading
+from bisect import bisect_left, insort
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over venue and artist names.
+
+    Every word of a name is stored as a (key, kind, id) tuple in one sorted
+    list, so a lookup is a bisect to the first key >= prefix followed by a
+    short forward scan. Keys start at each word so "hop" finds
+    "The Musical Hop" as well as names that begin with it.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.names = {}
+        self.lock = threading.Lock()
+        self.load_lock = threading.Lock()
+        self.loaded = False
+
+    @staticmethod
+    def keys_for(name):
+        words = normalize(name).split(' ')
+        return {' '.join(words[i:]) for i in range(len(words)) if words[i]}
+
+    def load(self, rows):
+        # bulk load builds the list unsorted and sorts once: O(n log n)
+        # rather than n insorts
+        names = {}
+        entries = []
+        for kind, entity_id, name in rows:
+            names[(kind, entity_id)] = name
+            entries.extend((key, kind, entity_id) for key in self.keys_for(name))
+        entries.sort()
+        with self.lock:
+            self.names = names
+            self.entries = entries
+            self.loaded = True
+
+    def load_once(self, source):
+        # source is only called by the first thread to get here
+        with self.load_lock:
+            if not self.loaded:
+                self.load(source())
+        return self
+
+    def add(self, kind, entity_id, name):
+        # updates before the first load are dropped, the load picks them up
+        with self.lock:
+            if not self.loaded:
+                return
+            self._remove(kind, entity_id)
+            self.names[(kind, entity_id)] = name
+            for key in self.keys_for(name):
+                insort(self.entries, (key, kind, entity_id))
+
+    def remove(self, kind, entity_id):
+        with self.lock:
+            self._remove(kind, entity_id)
+
+    def _remove(self, kind, entity_id):
+        name = self.names.pop((kind, entity_id), None)
+        if name is None:
+            return
+        for key in self.keys_for(name):
+            entry = (key, kind, entity_id)
+            i = bisect_left(self.entries, entry)
+            if i < len(self.entries) and self.entries[i] == entry:
+                del self.entries[i]
+
+    def lookup(self, prefix, limit=10, kind=None):
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            entries = self.entries
+            i = bisect_left(entries, (prefix,))
+            while i < len(entries) and len(results) < limit:
+                key, entry_kind, entity_id = entries[i]
+                if not key.startswith(prefix):
+                    break
+                i += 1
+                if (kind and entry_kind != kind) or (entry_kind, entity_id) in seen:
+                    continue
+                seen.add((entry_kind, entity_id))
+                results.append({'type': entry_kind, 'id': entity_id, 'name': self.names[(entry_kind, entity_id)]})
+        return results
+
+    def memory_usage(self):
+        # deep size of the list, its tuples and key strings plus the name map
+        with self.lock:
+            return self._memory_usage()
+
+    def _memory_usage(self):
+        size = sys.getsizeof(self.entries) + sys.getsizeof(self.names)
+        for entry in self.entries:
+            size += sys.getsizeof(entry) + sys.getsizeof(entry[0])
+        for key, name in self.names.items():
+            size += sys.getsizeof(key) + sys.getsizeof(name)
+        return {
+            'entries': len(self.entries),
+            'names': len(self.names),
+            'bytes': size,
+        }
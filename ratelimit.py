@@ -0,0 +1,110 @@
+import threading
+import time
+from collections import Counter
+
+
+class Buckets:
+    """Token buckets per key, kept as the time each bucket is full again.
+
+    This is the generic cell rate algorithm: a bucket of `burst` tokens
+    refilled at `rate` per second is fully described by its "theoretical
+    arrival time", so there is one float per client and nothing to refill
+    in the background. The shared Postgres backend stores the same value.
+    """
+
+    def __init__(self):
+        self.tat = {}
+        self.lock = threading.Lock()
+        self.pruned_at = time.monotonic()
+
+    def take(self, key, rate, burst):
+        """Take a token; returns 0 if there was one, else seconds until there is."""
+        interval = 1 / rate
+        now = time.monotonic()
+        with self.lock:
+            tat = max(self.tat.get(key, now), now)
+            if tat - now > (burst - 1) * interval:
+                return tat - now - (burst - 1) * interval
+            self.tat[key] = tat + interval
+            if now - self.pruned_at > 60:
+                self.prune(now)
+        return 0
+
+    def prune(self, now):
+        # a bucket that has refilled holds nothing worth remembering
+        for key in [key for key, tat in self.tat.items() if tat <= now]:
+            del self.tat[key]
+        self.pruned_at = now
+
+
+class Gate:
+    """Caps how many requests of one policy run at once in this worker.
+
+    Up to `queue` requests beyond `limit` wait up to `timeout` seconds for a
+    slot; any more are turned away at once rather than piling up threads.
+    """
+
+    def __init__(self, limit, queue, timeout):
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.counts = Counter()
+        self.condition = threading.Condition()
+
+    def enter(self):
+        with self.condition:
+            if self.running >= self.limit:
+                if self.waiting >= self.queue:
+                    self.counts['shed'] += 1
+                    return False
+                self.waiting += 1
+                self.counts['queued'] += 1
+                try:
+                    admitted = self.condition.wait_for(lambda: self.running < self.limit, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.counts['timed_out'] += 1
+                    return False
+            self.running += 1
+            self.counts['admitted'] += 1
+            return True
+
+    def leave(self):
+        with self.condition:
+            self.running -= 1
+            self.condition.notify()
+
+    def stats(self):
+        with self.condition:
+            return dict(self.counts, running=self.running, waiting=self.waiting,
+                limit=self.limit, queue=self.queue)
+
+
+class Limiter:
+    """Rate limits per client plus concurrency gates, one of each per policy.
+
+    take is (key, rate, burst) -> seconds to wait, defaulting to in-process
+    buckets; pass a shared implementation to limit clients across workers.
+    """
+
+    def __init__(self, policies, timeout, take=None):
+        self.policies = policies
+        self.gates = {name: Gate(policy['concurrency'], policy['queue'], timeout)
+            for name, policy in policies.items()}
+        self.buckets = Buckets()
+        self.take_token = take or self.buckets.take
+        self.rate_limited = Counter()
+
+    def take(self, name, client):
+        policy = self.policies[name]
+        wait = self.take_token(f'{name}:{client}', policy['rate'], policy['burst'])
+        if wait:
+            self.rate_limited[name] += 1
+        return wait
+
+    def stats(self):
+        return {name: dict(gate.stats(), rate_limited=self.rate_limited[name])
+            for name, gate in self.gates.items()}
@@ -0,0 +1,47 @@
+from dateutil.rrule import rrule, rrulestr, WEEKLY, MONTHLY, weekday
+
+# repeat choices offered by ShowForm
+FREQUENCIES = {
+    'weekly': WEEKLY,
+    'monthly': MONTHLY,
+    # e.g. every second Friday of the month
+    'monthly_weekday': MONTHLY,
+}
+WEEKDAYS = ('MO', 'TU', 'WE', 'TH', 'FR', 'SA', 'SU')
+
+
+def build_rule(repeat, start, interval=1, until=None, count=None, weekdays=()):
+    """An rrule for a show series starting at start; until is inclusive."""
+    options = {'dtstart': start, 'interval': interval or 1}
+    if until is not None:
+        # a date means "up to and including that day"
+        options['until'] = start.replace(year=until.year, month=until.month, day=until.day, hour=23, minute=59)
+    if count:
+        options['count'] = count
+    if repeat == 'weekly' and weekdays:
+        options['byweekday'] = [WEEKDAYS.index(day) for day in weekdays]
+    elif repeat == 'monthly_weekday':
+        # the nth weekday of start's month, counted from the end for the
+        # last week so "last Friday" stays last in shorter months
+        nth = (start.day - 1) // 7 + 1
+        options['byweekday'] = weekday(start.weekday(), nth if nth < 5 else -1)
+    return rrule(FREQUENCIES[repeat], **options)
+
+
+def occurrences(rule, limit):
+    """Start times of rule, or None if it has more than limit."""
+    times = []
+    for start_time in rule:
+        if len(times) == limit:
+            return None
+        times.append(start_time)
+    return times
+
+
+def rule_text(rule):
+    # the RRULE line without DTSTART, which the series stores separately
+    return str(rule).split('\n')[-1]
+
+
+def parse_rule(text, start):
+    return rrulestr(text, dtstart=start)
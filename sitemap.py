@@ -0,0 +1,74 @@
+import gzip
+import json
+import os
+from xml.sax.saxutils import escape
+
+# the protocol's limit of URLs per sitemap file; chunks are fixed id ranges
+# of this size, so an edit only ever changes the one chunk holding its id
+CHUNK_SIZE = 50000
+XMLNS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+INDEX_NAME = 'sitemap.xml'
+
+
+def chunk_name(kind, chunk):
+    return f'{kind}s-{chunk:05d}.xml.gz'
+
+
+def format_lastmod(moment):
+    return moment.isoformat(timespec='seconds')
+
+
+def fingerprint(count, id_sum, lastmod):
+    # changes with any insert, delete or lastmod bump inside the chunk;
+    # lastmod at full precision, edits within a second of each other count
+    return f'{count}:{id_sum}:{lastmod.isoformat()}'
+
+
+def write_urlset(path, urls, batch=1000):
+    """Write (loc, lastmod) pairs to a gzipped urlset as they arrive, atomically.
+
+    Returns how many URLs were written. The gzip header carries no
+    timestamp, so unchanged content gives byte-identical files.
+    """
+    partial = path + '.partial'
+    count = 0
+    with open(partial, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as output:
+        output.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{XMLNS}">\n'.encode())
+        lines = []
+        for loc, lastmod in urls:
+            lines.append(f'<url><loc>{escape(loc)}</loc><lastmod>{format_lastmod(lastmod)}</lastmod></url>\n')
+            if len(lines) == batch:
+                output.write(''.join(lines).encode())
+                count += len(lines)
+                lines = []
+        lines.append('</urlset>\n')
+        output.write(''.join(lines).encode())
+        count += len(lines) - 1
+    os.replace(partial, path)
+    return count
+
+
+def write_index(path, sitemaps):
+    """Write the sitemap index for (loc, lastmod) pairs, atomically."""
+    partial = path + '.partial'
+    with open(partial, 'w', encoding='utf-8') as output:
+        output.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{XMLNS}">\n')
+        for loc, lastmod in sitemaps:
+            output.write(f'<sitemap><loc>{escape(loc)}</loc><lastmod>{lastmod}</lastmod></sitemap>\n')
+        output.write('</sitemapindex>\n')
+    os.replace(partial, path)
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, 'manifest.json')) as state:
+            return json.load(state)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(directory, manifest):
+    path = os.path.join(directory, 'manifest.json')
+    with open(path + '.partial', 'w') as state:
+        json.dump(manifest, state, indent=2, sort_keys=True)
+    os.replace(path + '.partial', path)
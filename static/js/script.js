@@ -2,3 +2,25 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+  var list = document.getElementById(input.getAttribute('list'));
+  var pending = null;
+  input.addEventListener('input', function () {
+    clearTimeout(pending);
+    pending = setTimeout(function () {
+      var q = input.value.trim();
+      if (!q) { list.innerHTML = ''; return; }
+      fetch('/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(q))
+        .then(function (response) { return response.json(); })
+        .then(function (suggestions) {
+          list.innerHTML = '';
+          suggestions.forEach(function (suggestion) {
+            var option = document.createElement('option');
+            option.value = suggestion.name;
+            list.appendChild(option);
+          });
+        });
+    }, 100);
+  });
+});
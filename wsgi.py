@@ -0,0 +1,12 @@
+"""Production entry point: gunicorn -c gunicorn.conf.py wsgi:app"""
+import os
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from app import app
+
+# behind nginx or a load balancer, PROXY_HOPS=1 makes request.remote_addr
+# (used by the rate limits) the client's address rather than the proxy's
+if int(os.environ.get('PROXY_HOPS', 0)):
+    hops = int(os.environ['PROXY_HOPS'])
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops, x_host=hops)